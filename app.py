@@ -1,12 +1,78 @@
-from flask import Flask, render_template, request, jsonify, send_file
+import time
+STARTED = time.perf_counter()
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory, stream_with_context
+from werkzeug.http import dump_options_header
+from werkzeug.utils import secure_filename
 import os
-from utils import extract_comp_plan_content, render_comp_plan_template, output_template_to_txt
-import zipfile
+import unicodedata
+from urllib.parse import quote
+# the extraction stack (pdfplumber, pandas, ...) is only loaded by the extraction workers
+from constants import EXPORT_FORMATS, EXTRACTOR_VERSION
+from jobs import JobQueue, iter_zip
+from cache import LayoutProfiles, PlanCache, PageCache
+from store import PlanStore
 
 app = Flask(__name__)
 UPLOAD_FOLDER = "uploads"
+JOB_TTL = int(os.environ.get("JOB_TTL", 3600))
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", 1))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+# resident worker processes extracting the uploaded files, 0 extracts in the job threads instead
+EXTRACT_PROCESSES = int(os.environ.get("EXTRACT_PROCESSES", JOB_WORKERS))
+PLAN_CACHE_FOLDER = os.environ.get("PLAN_CACHE_FOLDER", "plan_cache")
+PLAN_CACHE_MAX_MB = int(os.environ.get("PLAN_CACHE_MAX_MB", 512))
+PAGE_CACHE_MAX_MB = int(os.environ.get("PAGE_CACHE_MAX_MB", 1024))
+# off by default: detecting tables once per page measured no consistent gain over per-crop detection
+SHARED_TABLE_DETECTION = os.environ.get("SHARED_TABLE_DETECTION", "0") == "1"
+STREAMING_EXTRACTION = os.environ.get("STREAMING_EXTRACTION", "0") == "1"
+# MB the RSS of the extracting process may grow by per document, with STREAMING_EXTRACTION and without page workers
+EXTRACT_MEMORY_LIMIT_MB = int(os.environ.get("EXTRACT_MEMORY_LIMIT_MB", 0))
+# opt-in: matching pages against the learned layouts costs about as much as it saves on the synthetic decks
+LAYOUT_PROFILES = os.environ.get("LAYOUT_PROFILES", "0") == "1"
+# seconds, 0 turns the budget off. Pages over budget are parsed again by the text-only fallback
+PAGE_TIME_BUDGET = float(os.environ.get("PAGE_TIME_BUDGET", 0))
+DOCUMENT_TIME_BUDGET = float(os.environ.get("DOCUMENT_TIME_BUDGET", 0))
+# SQLite store of every extracted plan behind the /store endpoints, empty to turn it off
+PLAN_STORE = os.environ.get("PLAN_STORE", "plan_store.sqlite3")
+# comma separated exports written next to every .txt output, e.g. "jsonl,parquet"
+EXPORTS = [export_format for export_format in os.environ.get("EXPORTS", "").split(",") if export_format]
+if unknown_exports := set(EXPORTS) - set(EXPORT_FORMATS):
+    raise ValueError(f"Unknown EXPORTS {', '.join(sorted(unknown_exports))}, expected some of {', '.join(EXPORT_FORMATS)}")
+# shared table detection can pick slightly different tables, so its results are cached apart
+CACHE_VERSION = f"{EXTRACTOR_VERSION}-shared-tables" if SHARED_TABLE_DETECTION else EXTRACTOR_VERSION
+plan_cache = PlanCache(PLAN_CACHE_FOLDER, max_bytes=PLAN_CACHE_MAX_MB * 1024 * 1024, version=CACHE_VERSION)
+page_cache = PageCache(os.path.join(PLAN_CACHE_FOLDER, "pages"), max_bytes=PAGE_CACHE_MAX_MB * 1024 * 1024, version=CACHE_VERSION)
+layout_profiles = LayoutProfiles(os.path.join(PLAN_CACHE_FOLDER, "layout_profiles.json"), version=CACHE_VERSION) if LAYOUT_PROFILES else None
+plan_store = PlanStore(PLAN_STORE, version=CACHE_VERSION) if PLAN_STORE else None
+job_queue = JobQueue(
+    max_workers=JOB_WORKERS,
+    extract_workers=EXTRACT_WORKERS,
+    cache=plan_cache,
+    page_cache=page_cache,
+    shared_tables=SHARED_TABLE_DETECTION,
+    streaming=STREAMING_EXTRACTION,
+    memory_limit=EXTRACT_MEMORY_LIMIT_MB * 1024 * 1024 or None,
+    workspace=UPLOAD_FOLDER,
+    ttl=JOB_TTL,
+    layouts=layout_profiles,
+    page_budget=PAGE_TIME_BUDGET or None,
+    document_budget=DOCUMENT_TIME_BUDGET or None,
+    store=plan_store,
+    exports=EXPORTS,
+    processes=EXTRACT_PROCESSES
+)
 
 
+def attachment(file_name):
+    """Content-Disposition of a download, quoted as needed, with an RFC 5987 filename* for non-ASCII names"""
+    try:
+        file_name.encode("ascii")
+        options = {"filename": file_name}
+    except UnicodeEncodeError:
+        ascii_name = unicodedata.normalize("NFKD", file_name).encode("ascii", "ignore").decode("ascii")
+        options = {"filename": ascii_name, "filename*": f"UTF-8''{quote(file_name, safe='')}"}
+    return dump_options_header("attachment", options)
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -14,39 +80,113 @@ def index():
 @app.route("/extract", methods=["POST"])
 def extract():
     try:
-        if os.path.exists(UPLOAD_FOLDER):
-            os.system(f"del /f /s /q {UPLOAD_FOLDER} 1>nul\nrmdir /s /q {UPLOAD_FOLDER}")
-        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
         files = request.files.getlist("files")
         if not files:
             return jsonify({'error': 'No JSON data received'}), 400
 
-        saved_files = []
+        file_names = []
         for file in files:
-            file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-            file.save(file_path)
-            saved_files.append(file.filename)
-        file_names = [os.path.join(UPLOAD_FOLDER, file_) for file_ in saved_files]
-        converted_file_names = [file_name.replace(".pdf", ".txt") for file_name in saved_files]
-        
-        for file in file_names:
-            comp_plan = extract_comp_plan_content(file)
-            template = render_comp_plan_template(comp_plan)
-            output_template_to_txt(template, file.replace(".pdf", ".txt"))
-
-        return jsonify({"convertedFiles": converted_file_names, "download_dir": "/download"})
+            if not file.filename:
+                return jsonify({'error': 'Missing file name'}), 400
+            # secure_filename drops non-ASCII characters, a name made of them only gets a generated stem.
+            # Every upload is saved as .pdf, so its .txt output can never land on the PDF itself
+            stem = file.filename[:-len(".pdf")] if file.filename.lower().endswith(".pdf") else file.filename
+            stem = secure_filename(stem) or "upload"
+            file_name, copy = f"{stem}.pdf", 1
+            while file_name in file_names: # same name uploaded twice in this job
+                copy += 1
+                file_name = f"{stem}_{copy}.pdf"
+            file_names.append(file_name)
+
+        job_id = job_queue.new_job_id()
+        job_folder = job_queue.new_workspace(job_id)
+        for file, file_name in zip(files, file_names):
+            file.save(os.path.join(job_folder, file_name))
+
+        # the profiled file is named as uploaded, the first file of that name is profiled
+        uploaded = {file.filename: file_name for file, file_name in reversed(list(zip(files, file_names)))}
+        job_queue.submit(job_id, job_folder, file_names, profile=uploaded.get(request.form.get("profile")))
+        return jsonify({"jobId": job_id, "status_url": f"/jobs/{job_id}", "download_dir": f"/download/{job_id}"}), 202
 
     except Exception as e:
         print(e)
         return jsonify({'error': str(e)}), 500
 
-@app.route("/download")
-def download_files():
-    files = [file for file in os.listdir(UPLOAD_FOLDER) if file.endswith(".txt")]
-    with zipfile.ZipFile(os.path.join(UPLOAD_FOLDER, "download.zip"), "w") as zip:
-        for file in files:
-            zip.write(os.path.join(UPLOAD_FOLDER, file), arcname=file)
-    return send_file(os.path.join(UPLOAD_FOLDER, "download.zip"), as_attachment=True)
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route("/jobs/<job_id>/files/<file_name>")
+def job_result(job_id, file_name):
+    job = job_queue.get(job_id)
+    if job is None or (file := job.get_file(file_name)) is None:
+        return jsonify({'error': 'Result not available'}), 404
+    if file.status == "done":
+        return send_from_directory(job.folder, file_name if file_name in (file.profile, *file.exports) else file.output, as_attachment=True)
+    # parsed but still being written out, render it again from the cached plan as a chunked response
+    if file.status == "rendering" and (comp_plan := plan_cache.get(plan_cache.key(os.path.join(job.folder, file.name)))) is not None:
+        from utils import iter_comp_plan_template
+        return Response(
+            stream_with_context(iter_comp_plan_template(comp_plan)),
+            mimetype="text/plain",
+            headers={"Content-Disposition": attachment(file_name)}
+        )
+    return jsonify({'error': 'Result not available'}), 404
+
+@app.route("/cache")
+def cache_stats():
+    return jsonify({"plans": plan_cache.stats(), "pages": page_cache.stats(), "layouts": layout_profiles.stats() if layout_profiles else None, "store": plan_store.stats() if plan_store else None})
+
+@app.route("/metrics")
+def metrics():
+    return Response(job_queue.metrics.to_prometheus(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/store/documents")
+def store_documents():
+    if plan_store is None:
+        return jsonify({'error': 'Plan store is disabled'}), 404
+    return jsonify(plan_store.documents(request.args.get("title")))
+
+@app.route("/store/roles")
+def store_roles():
+    if plan_store is None:
+        return jsonify({'error': 'Plan store is disabled'}), 404
+    args = request.args
+    return jsonify(plan_store.roles(args.get("title"), args.get("document"), args.get("product"), args.get("limit", 100, type=int)))
+
+@app.route("/store/products/<path:product>")
+def store_products(product):
+    if plan_store is None:
+        return jsonify({'error': 'Plan store is disabled'}), 404
+    return jsonify(plan_store.products(product, request.args.get("document")))
+
+@app.route("/startup")
+def startup():
+    return jsonify({
+        "startupSeconds": round(STARTUP_SECONDS, 3),
+        "firstJobSeconds": job_queue.first_job_seconds,
+        "workers": job_queue.pool.stats() if job_queue.pool is not None else None
+    })
+
+@app.route("/download/<job_id>")
+def download_files(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    files = [output for file in job.finished_files for output in (file.output, *file.exports)]
+    return Response(
+        stream_with_context(iter_zip(job.folder, files)),
+        mimetype="application/zip",
+        headers={"Content-Disposition": attachment(f"{job_id}.zip")}
+    )
+
+STARTUP_SECONDS = time.perf_counter() - STARTED
+job_queue.metrics.set_gauge("startup_seconds", STARTUP_SECONDS, "Seconds to import and set up the web app, the workers warm up after")
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    # the reloader imports this module again in its watcher process and on every reload, each time
+    # starting another set of extraction workers, so it only runs with in-thread extraction
+    app.run(debug=True, use_reloader=EXTRACT_PROCESSES == 0)
@@ -0,0 +1,177 @@
+"""Throughput, per-stage latency and peak memory of extract_comp_plan_content and
+render_comp_plan_template on the synthetic corpus, compared against a stored baseline.
+
+    python -m benchmarks.bench                      # small and medium decks, serial mode
+    python -m benchmarks.bench --sizes large --modes serial,streaming,shared-tables
+    python -m benchmarks.bench --save-baseline      # record the current numbers as the baseline
+
+Every case runs in a fresh process so one case's caches and heap do not leak into the next"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from benchmarks.synthetic import SIZES, generate
+
+BENCHMARK_FOLDER = os.path.dirname(os.path.abspath(__file__))
+CORPUS_FOLDER = os.path.join(BENCHMARK_FOLDER, "corpus")
+BASELINE = os.path.join(BENCHMARK_FOLDER, "baseline.json")
+
+# extract_comp_plan_content keyword arguments of each mode
+MODES = {
+    "serial": {},
+    "streaming": {"streaming": True},
+    "shared-tables": {"shared_tables": True},
+    "workers": {"workers": os.cpu_count() or 1},
+}
+
+
+def corpus_file(size, seed=0):
+    """Path of the synthetic deck of `size`, generated on first use"""
+    path = os.path.join(CORPUS_FOLDER, f"{size}-{seed}.pdf")
+    if not os.path.exists(path):
+        os.makedirs(CORPUS_FOLDER, exist_ok=True)
+        generate(path, seed=seed, **SIZES[size])
+    return path
+
+def run_case(path, mode, repeat):
+    """Runs in a worker process: times `repeat` extractions and renders of `path`"""
+    from utils import current_rss, extract_comp_plan_content, iter_comp_plan_template
+
+    runs = []
+    for _ in range(repeat):
+        report = {}
+        start = time.perf_counter()
+        comp_plan = extract_comp_plan_content(path, report=report, **MODES[mode])
+        extract_seconds = time.perf_counter() - start
+
+        render_peak = current_rss() or 0
+        start = time.perf_counter()
+        for _ in iter_comp_plan_template(comp_plan):
+            render_peak = max(render_peak, current_rss() or 0)
+        render_seconds = time.perf_counter() - start
+        runs.append({
+            "pages": len(report["pages"]),
+            "extract_seconds": extract_seconds,
+            "render_seconds": render_seconds,
+            "extract_peak_rss": report["peak_rss"],
+            "render_peak_rss": render_peak,
+            "stages": {stage: totals["seconds"] for stage, totals in report["stages"].items()},
+        })
+    return runs
+
+def summarize(runs):
+    """Medians across the repeats, per-stage latency is the median seconds of each stage"""
+    pages = runs[0]["pages"]
+    extract_seconds = statistics.median(run["extract_seconds"] for run in runs)
+    return {
+        "pages": pages,
+        "pages_per_second": round(pages / extract_seconds, 3),
+        "extract_seconds": round(extract_seconds, 4),
+        "render_seconds": round(statistics.median(run["render_seconds"] for run in runs), 4),
+        "extract_peak_mb": round(max(run["extract_peak_rss"] or 0 for run in runs) / 2**20, 1),
+        "render_peak_mb": round(max(run["render_peak_rss"] for run in runs) / 2**20, 1),
+        "stages": {stage: round(statistics.median(run["stages"].get(stage, 0.0) for run in runs), 4) for stage in runs[0]["stages"]},
+    }
+
+def run_benchmarks(sizes, modes, repeat=3):
+    results = {}
+    for size in sizes:
+        path = corpus_file(size)
+        for mode in modes:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                runs = executor.submit(run_case, path, mode, repeat).result()
+            results[f"{size}/{mode}"] = summarize(runs)
+            print_case(f"{size}/{mode}", results[f"{size}/{mode}"])
+    return results
+
+def print_case(case, result):
+    print(f"{case:<24} {result['pages']:>4} pages  {result['pages_per_second']:>7.2f} pages/s  "
+          f"extract {result['extract_seconds']:.3f}s  render {result['render_seconds']:.3f}s  "
+          f"peak {result['extract_peak_mb']:.0f}/{result['render_peak_mb']:.0f} MB")
+    slowest = sorted(((stage, seconds) for stage, seconds in result["stages"].items() if stage not in ("document", "page")), key=lambda item: -item[1])
+    print("    " + ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in slowest[:6]))
+
+def host():
+    """The machine the numbers were taken on, stored with the baseline"""
+    return {"machine": platform.machine(), "system": platform.system(), "python": platform.python_version(), "cpus": os.cpu_count()}
+
+def stage_differences(results, baseline):
+    """Stages timed on only one side of a case, renamed or removed since the baseline, left out of the comparison"""
+    differences = []
+    for case, result in results.items():
+        if (base := baseline.get(case)) is None:
+            continue
+        if added := sorted(result["stages"].keys() - base["stages"].keys()):
+            differences.append(f"{case}: not in the baseline {', '.join(added)}")
+        if removed := sorted(base["stages"].keys() - result["stages"].keys()):
+            differences.append(f"{case}: only in the baseline {', '.join(removed)}")
+    return differences
+
+def compare(results, baseline, tolerance):
+    """Cases slower or heavier than the baseline by more than `tolerance` (a fraction)"""
+    regressions = []
+    for case, result in results.items():
+        if (base := baseline.get(case)) is None:
+            continue
+        checks = [
+            ("pages/s", base["pages_per_second"], result["pages_per_second"], True),
+            ("render seconds", base["render_seconds"], result["render_seconds"], False),
+            ("extract peak MB", base["extract_peak_mb"], result["extract_peak_mb"], False),
+            ("render peak MB", base["render_peak_mb"], result["render_peak_mb"], False),
+        ]
+        for metric, before, after, higher_is_better in checks:
+            if not before:
+                continue
+            change = (after - before) / before
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{case}: {metric} {before} -> {after} ({change:+.0%})")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark extraction and rendering on synthetic plans")
+    parser.add_argument("--sizes", default="small,medium", help=f"comma separated, from {', '.join(SIZES)}")
+    parser.add_argument("--modes", default="serial", help=f"comma separated, from {', '.join(MODES)}")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown or memory growth before flagging, as a fraction")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline instead of comparing")
+    parser.add_argument("--output", help="also write the results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes.split(","), args.modes.split(","), args.repeat)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        if baseline.get("host") != host():
+            baseline = {} # cases timed on another machine are not kept next to these
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({**baseline, **results, "host": host()}, f, indent=2, sort_keys=True)
+        print(f"baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}, run with --save-baseline first")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("host") != host():
+        print(f"baseline recorded on {baseline.get('host', 'an unknown host')}, this host is {host()}")
+    for difference in stage_differences(results, baseline):
+        print(f"stages {difference}")
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print("no regressions against the baseline")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
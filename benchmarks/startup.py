@@ -0,0 +1,99 @@
+"""Cold start of the web app: seconds to import app.py, until the extraction workers are warm,
+and the latency of the first requests, each case in a fresh interpreter and working folder.
+
+    python -m benchmarks.startup                    # in-thread extraction against 1 and 4 workers
+    python -m benchmarks.startup --processes 0,2 --output startup.json
+
+`first` submits a plan as soon as app.py is imported, like a request reaching a container that
+just started, `warm` submits one once every worker is warm"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.bench import corpus_file
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXTRACTION_STACK = ("pdfplumber", "pdfminer", "pandas", "numpy", "rapidfuzz", "tabulate")
+# evict every cached page and plan and learn no layouts, so the warm request is not faster only for
+# reusing what the first one parsed
+NO_REUSE = {"PLAN_CACHE_MAX_MB": "0", "PAGE_CACHE_MAX_MB": "0", "LAYOUT_PROFILES": "0"}
+
+
+def submit(client, path):
+    """Seconds from uploading `path` until its job is finished"""
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        response = client.post("/extract", data={"files": [(f, os.path.basename(path))]}, content_type="multipart/form-data")
+    job_id = response.json["jobId"]
+    while client.get(f"/jobs/{job_id}").json["status"] not in ("done", "failed"):
+        time.sleep(0.01)
+    return time.perf_counter() - start
+
+def run_case(paths):
+    """Runs in the fresh interpreter, EXTRACT_PROCESSES is already set"""
+    start = time.perf_counter()
+    import app
+    import_seconds = time.perf_counter() - start
+    stack_loaded = [module for module in EXTRACTION_STACK if module in sys.modules]
+    client = app.app.test_client()
+    first = submit(client, paths[0])
+    pool = app.job_queue.pool
+    while pool is not None and pool.ready_seconds is None:
+        time.sleep(0.01)
+    warm = submit(client, paths[1])
+    return {
+        "import_seconds": round(import_seconds, 4),
+        "workers_ready_seconds": None if pool is None else round(pool.ready_seconds, 4),
+        "first_request_seconds": round(first, 4),
+        "warm_request_seconds": round(warm, 4),
+        "stack_loaded_by_import": stack_loaded,
+    }
+
+def run_benchmarks(processes, size, repeat):
+    # different plans, so the second request is not served from the plan cache
+    paths = [corpus_file(size, seed) for seed in (0, 1)]
+    results = {}
+    for count in processes:
+        runs = []
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as folder:
+                env = {**os.environ, **NO_REUSE, "EXTRACT_PROCESSES": str(count), "PYTHONPATH": ROOT}
+                output = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.startup", "--case", *paths],
+                    cwd=folder, env=env, capture_output=True, text=True, check=True
+                ).stdout
+                runs.append(json.loads(output.splitlines()[-1]))
+        results[f"processes={count}"] = min(runs, key=lambda run: run["first_request_seconds"])
+        print_case(f"processes={count}", results[f"processes={count}"])
+    return results
+
+def print_case(case, result):
+    ready = result["workers_ready_seconds"]
+    print(f"{case:<14} import {result['import_seconds']:.3f}s  workers warm {'-' if ready is None else f'{ready:.3f}s':>7}  "
+          f"first request {result['first_request_seconds']:.3f}s  warm request {result['warm_request_seconds']:.3f}s")
+    if result["stack_loaded_by_import"]:
+        print(f"    importing app.py loaded {', '.join(result['stack_loaded_by_import'])}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the startup and first requests of the web app")
+    parser.add_argument("--processes", default="0,1,4", help="comma separated EXTRACT_PROCESSES to compare, 0 extracts in the job threads")
+    parser.add_argument("--size", default="small", help="synthetic plan size of the requests")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, the fastest first request is kept")
+    parser.add_argument("--output", help="also write the results as JSON to this path")
+    parser.add_argument("--case", nargs=2, metavar="PDF", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        print(json.dumps(run_case(args.case)))
+        return 0
+    results = run_benchmarks([int(count) for count in args.processes.split(",")], args.size, args.repeat)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
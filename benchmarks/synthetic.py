@@ -0,0 +1,147 @@
+"""Synthetic compensation plan decks laid out the way the parsers in utils.py expect them:
+a cover page of role columns under bold group headings, detail pages with the Metric Bucket,
+PayCurve, Gate Text, Quota Cadence, Unbalanced, Other Information and Attainment Modifiers
+sections, attainment modifier spillover pages, blank pages, and product eligibility tables
+running over continuation pages"""
+import random
+
+try:
+    from reportlab.pdfgen import canvas
+except ImportError:
+    canvas = None
+
+WIDTH, HEIGHT = 792.0, 612.0 # landscape letter
+FONT, BOLD = "Helvetica", "Helvetica-Bold"
+
+# keyword arguments of generate for each corpus size
+SIZES = {
+    "small": dict(n_roles=8, n_details=4, n_mods=6, n_pe_rows=10, n_cont=2),
+    "medium": dict(n_roles=16, n_details=12, n_mods=8, n_pe_rows=14, n_cont=3),
+    "large": dict(n_roles=24, n_details=40, n_mods=10, n_pe_rows=14, n_cont=4),
+}
+
+
+def draw_text(c, x, top, text, bold=False, size=9):
+    c.setFont(BOLD if bold else FONT, size)
+    c.drawString(x, HEIGHT - top - size, text)
+
+def draw_table(c, x, top, widths, rows, line_height=11, size=8):
+    """Ruled table with its top left corner at (x, top), cells may hold several lines"""
+    heights = [max(len(str(cell).split("\n")) for cell in row) * line_height + 4 for row in rows]
+    xs = [x]
+    for width in widths:
+        xs.append(xs[-1] + width)
+    ys = [top]
+    for height in heights:
+        ys.append(ys[-1] + height)
+    for y in ys:
+        c.line(xs[0], HEIGHT - y, xs[-1], HEIGHT - y)
+    for x in xs:
+        c.line(x, HEIGHT - ys[0], x, HEIGHT - ys[-1])
+    for row_idx, row in enumerate(rows):
+        for col_idx, cell in enumerate(row):
+            for line_idx, line in enumerate(str(cell).split("\n")):
+                if line:
+                    draw_text(c, xs[col_idx] + 3, ys[row_idx] + 2 + line_idx * line_height, line, size=size)
+    return ys[-1]
+
+def draw_cover(c, n_roles):
+    draw_text(c, 30, 40, "2HFY25 - Synthetic Compensation Plans", bold=True, size=14)
+    for col in range(3):
+        x = 30 + col * 250
+        top = 130 + col * 5
+        draw_text(c, x, top, f"Group {col}", bold=True)
+        for i in range(n_roles):
+            draw_text(c, x, top + 16 * (i + 1), f"Role {col}-{i} Plan")
+    c.showPage()
+
+def draw_details(c, title, rng, n_mods, dy=0, show_page=True):
+    def text(x, top, *args, **kwargs):
+        draw_text(c, x, top + dy, *args, **kwargs)
+
+    def table(x, top, *args, **kwargs):
+        draw_table(c, x, top + dy, *args, **kwargs)
+
+    text(30, 45, title, bold=True, size=12)
+    text(30, 90, "Metric Bucket", bold=True)
+    weightage = rng.randint(10, 90)
+    table(35, 105, [150], [[f"■ ISG Revenue {weightage}%\n■ CSG {100 - weightage}%"], ["Total 100%"]])
+    text(260, 90, "PayCurve", bold=True)
+    table(200, 105, [90, 60], [["0%-100%", "1x"], ["100%-200%", "2x"], ["200%-300%", "1.5x"], ["300%+", "1.25x"]])
+    text(430, 90, "Gate Text", bold=True)
+    text(430, 105, "None")
+    text(600, 90, "Quota Cadence", bold=True)
+    text(600, 105, "Quarterly")
+    text(430, 200, "Unbalanced", bold=True)
+    text(430, 215, "Plans with Rev Quotas will combine buckets.")
+    text(430, 330, "Other Information", bold=True)
+    text(430, 345, f"Eligible countries list {rng.randint(0, 999)}.")
+    text(60, 300, "Attainment Modifiers", bold=True)
+    table(40, 315, [180, 80], [[f"APEX Product {i}", f"{rng.randint(10, 30) / 10}x"] for i in range(n_mods)])
+    if show_page:
+        c.showPage()
+
+def draw_product_eligibility(c, n_rows, n_cont):
+    """Two eligibility tables side by side, followed by `n_cont` continuation pages of unruled rows"""
+    draw_text(c, 30, 45, "Product Eligibility", bold=True, size=12)
+    draw_text(c, 30, 75, "Click on Metric names to view details")
+    header = ["L1 Type", "L2 Type", "Product"]
+    table_xs = [30, 400]
+    widths = [110, 110, 130]
+    for table_idx, x in enumerate(table_xs):
+        rows = [header] + [[f"L1-{table_idx}-{i // 4}", f"L2-{table_idx}-{i // 2}", f"Prod {table_idx}-{i}"] for i in range(n_rows)]
+        draw_table(c, x, 95, widths, rows)
+    c.showPage()
+    for page in range(n_cont):
+        draw_text(c, 30, 45, f"continued {page}")
+        for table_idx, x in enumerate(table_xs):
+            for i in range(n_rows):
+                # staggered so the text lines of neighbouring columns are not merged
+                top = 70 + i * 40 + table_idx * 20
+                draw_text(c, x + 3, top, f"L1c-{table_idx}-{page}-{i // 4}")
+                draw_text(c, x + 3 + widths[0], top + 6, f"L2c-{table_idx}-{page}-{i // 2}")
+                draw_text(c, x + 3 + widths[0] + widths[1], top + 12, f"Prodc {table_idx}-{page}-{i}")
+        c.showPage()
+
+def draw_spillover(c, n_mods):
+    draw_text(c, 30, 45, "Attainment Modifiers (continued)", bold=True, size=12)
+    draw_table(c, 40, 90, [180, 80], [[f"APEX Spill {i}", "1.5x"] for i in range(n_mods)])
+    c.showPage()
+
+def draw_merged(c, rng, title, n_mods):
+    """Product eligibility table and the next role's details on the same page"""
+    draw_text(c, 30, 45, "Product Eligibility", bold=True, size=12)
+    draw_text(c, 30, 75, "Click on Metric names to view details")
+    rows = [["L1 Type", "L2 Type", "Product"]] + [[f"L1-m-{i}", f"L2-m-{i}", f"Prod m-{i}"] for i in range(3)]
+    draw_table(c, 30, 95, [110, 110, 130], rows)
+    draw_details(c, title, rng, n_mods, dy=160)
+
+def generate(path, n_roles=8, n_details=4, n_mods=6, n_pe_rows=10, n_cont=2, seed=0):
+    """Writes a deck of `n_details` role pairs to `path`, each pair followed by a blank page and
+    a product eligibility table over 1 + `n_cont` pages. Returns the number of pages"""
+    if canvas is None:
+        raise ImportError("reportlab is required to generate synthetic plans, pip install reportlab")
+    rng = random.Random(seed)
+    c = canvas.Canvas(path, pagesize=(WIDTH, HEIGHT))
+    draw_cover(c, n_roles)
+    for detail_idx in range(n_details):
+        for role_idx in range(2):
+            draw_details(c, f"Role {detail_idx}-{role_idx} : IC", rng, n_mods)
+        if detail_idx % 2:
+            draw_spillover(c, n_mods)
+        c.showPage() # blank page
+        draw_product_eligibility(c, n_pe_rows, n_cont)
+    draw_merged(c, rng, f"Role {n_details} : IC", n_mods)
+    draw_product_eligibility(c, n_pe_rows, n_cont)
+    num_pages = c.getPageNumber() - 1
+    c.save()
+    return num_pages
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Write a synthetic compensation plan PDF")
+    parser.add_argument("path")
+    parser.add_argument("--size", choices=SIZES, default="small")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(f"{generate(args.path, seed=args.seed, **SIZES[args.size])} pages written to {args.path}")
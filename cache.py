@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import zlib
+from constants import EXTRACTOR_VERSION
+
+
+class PlanCache:
+    """On-disk cache of parsed plans (the `infos` list of extract_comp_plan_content) keyed by
+    the PDF content hash and the extractor version, evicting least recently used entries once
+    the folder grows past `max_bytes`"""
+
+    def __init__(self, folder, max_bytes=512 * 1024 * 1024, version=EXTRACTOR_VERSION):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        # running estimate of the folder size, the folder is only rescanned once it passes max_bytes or
+        # this process wrote a sixteenth of max_bytes since the last scan: the worker processes sharing
+        # the folder each count their own writes only, so together they overshoot by N/16 at most
+        self.total_bytes = sum(size for _, size, _ in self.entries())
+        self.unscanned_bytes = 0
+
+    @staticmethod
+    def hash_file(file):
+        sha = hashlib.sha256()
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def key(self, file):
+        return f"{self.hash_file(file)}-v{self.version}"
+
+    def path(self, key):
+        return os.path.join(self.folder, f"{key}.plan")
+
+    def __getstate__(self):
+        # a copy handed to an extraction worker process keeps its own lock, counters and size estimate
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def record(self, hits=0, misses=0):
+        """Counts lookups, including the ones a worker process made on its copy of the cache"""
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                infos = pickle.loads(zlib.decompress(f.read()))
+            os.utime(path) # mtime is the LRU clock
+        except FileNotFoundError:
+            infos = None
+        except (pickle.UnpicklingError, zlib.error, EOFError, AttributeError, ImportError):
+            infos = None
+            self.remove(path)
+        self.record(hits=infos is not None, misses=infos is None)
+        return infos
+
+    def put(self, key, infos):
+        data = zlib.compress(pickle.dumps(infos, protocol=pickle.HIGHEST_PROTOCOL))
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.total_bytes += len(data)
+            self.unscanned_bytes += len(data)
+        if self.total_bytes > self.max_bytes or self.unscanned_bytes > self.max_bytes // 16:
+            self.evict()
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def entries(self):
+        entries = []
+        for name in os.listdir(self.folder):
+            if name.endswith(".plan"):
+                try:
+                    stat = os.stat(os.path.join(self.folder, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(self.folder, name)))
+        return entries
+
+    def evict(self):
+        with self.lock:
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            while entries and total > self.max_bytes:
+                _, size, path = entries.pop(0)
+                self.remove(path)
+                total -= size
+            self.total_bytes = total
+            self.unscanned_bytes = 0
+
+    def get_or_extract(self, file, extract, keep=None):
+        """`keep(infos)` decides whether a freshly extracted plan is cached, by default it always is"""
+        key = self.key(file)
+        if (infos := self.get(key)) is not None:
+            return infos, True
+        infos = extract(file)
+        if keep is None or keep(infos):
+            self.put(key, infos)
+        return infos, False
+
+    def stats(self):
+        entries = self.entries()
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+                "max_bytes": self.max_bytes
+            }
+
+class PageCache(PlanCache):
+    """Per-page store of parsed PageResults keyed by a fingerprint of the page content, so a
+    revised plan only re-parses the pages that changed. Continuation pages need no special
+    invalidation: a PageResult depends on its own page only and the stitching across pages
+    is always redone by merge_page_results"""
+
+    @staticmethod
+    def fingerprint(page):
+        from pdfminer.pdftypes import PDFStream, resolve1
+        from pdfminer.psparser import LIT
+        sha = hashlib.sha256()
+        page_obj = page.page_obj
+        sha.update(repr((page_obj.mediabox, page_obj.cropbox, page_obj.rotate)).encode())
+        for stream in page_obj.contents:
+            if isinstance(stream := resolve1(stream), PDFStream):
+                sha.update(stream.get_data())
+        resources = resolve1(page_obj.resources) or {}
+        for name, font in sorted((resolve1(resources.get("Font")) or {}).items()):
+            font = resolve1(font)
+            sha.update(f"{name}:{font.get('BaseFont')}".encode())
+            if isinstance(to_unicode := resolve1(font.get("ToUnicode")), PDFStream):
+                sha.update(to_unicode.get_data())
+        for name, xobject in sorted((resolve1(resources.get("XObject")) or {}).items()):
+            xobject = resolve1(xobject)
+            if isinstance(xobject, PDFStream) and xobject.get("Subtype") is LIT("Form"):
+                sha.update(name.encode())
+                sha.update(xobject.get_data())
+        return sha.hexdigest()
+
+    def key(self, page, index):
+        return f"{self.fingerprint(page)}-{'cover' if index == 0 else 'page'}-v{self.version}"
+
+class LayoutProfiles:
+    """Layout profiles (positions of the fixed section headings, see utils.build_layout_profile)
+    learned per page class and kept in a JSON file, so documents from a known template crop
+    straight to their sections. Up to `max_variants` layouts are kept per class, latest first.
+    Several processes can share the file: it is read again whenever another one rewrote it"""
+
+    def __init__(self, path, max_variants=4, version=EXTRACTOR_VERSION):
+        self.path = path
+        self.max_variants = max_variants
+        self.version = version
+        self.lock = threading.Lock()
+        self.profiles = {}
+        self.mtime = None
+        self.reload()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def reload(self):
+        """Reads the file again if it changed since it was last read, the caller holds the lock or
+        is the constructor"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self.mtime:
+                return
+            with open(self.path, encoding="utf-8") as f:
+                stored = json.load(f)
+            self.profiles = stored["profiles"] if stored.get("version") == self.version else {}
+            self.mtime = mtime
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError):
+            self.remove()
+
+    def snapshot(self):
+        with self.lock:
+            self.reload()
+            return {page_class: list(profiles) for page_class, profiles in self.profiles.items()}
+
+    def learn(self, learned):
+        """`learned` maps page classes to the layout a successful run discovered for them. A layout
+        learned at the same moment by another process can be lost, it is then simply learned again"""
+        if not learned:
+            return
+        with self.lock:
+            self.reload()
+            changed = False
+            for page_class, profile in learned.items():
+                known = self.profiles.get(page_class, [])
+                # a layout already known is not moved to the front, so the file is only rewritten for new layouts
+                if profile not in known:
+                    self.profiles[page_class] = [profile, *known][:self.max_variants]
+                    changed = True
+            if not changed:
+                return
+            data = json.dumps({"version": self.version, "profiles": self.profiles})
+            tmp_path = f"{self.path}.{os.getpid()}-{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+            self.mtime = os.stat(self.path).st_mtime_ns
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        with self.lock:
+            self.reload()
+            return {page_class: len(profiles) for page_class, profiles in self.profiles.items()}
@@ -0,0 +1,154 @@
+import argparse
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from cache import LayoutProfiles, PlanCache
+from store import PlanStore
+from utils import EXPORT_FORMATS, EXTRACTOR_VERSION, export_comp_plan, extract_comp_plan_content, iter_comp_plan_template, output_template_to_txt
+
+MANIFEST = "manifest.json"
+
+
+def find_inputs(source):
+    """`source` is a folder (every PDF inside it) or a glob pattern"""
+    if os.path.isdir(source):
+        pattern = os.path.join(source, "*.pdf")
+    else:
+        pattern = source
+    return sorted(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path) and path.lower().endswith(".pdf"))
+
+def input_root(source):
+    """Folder of `source`, or the part of the pattern before its first wildcard"""
+    root = source
+    while root and (glob.has_magic(root) or not os.path.isdir(root)):
+        root = os.path.dirname(root)
+    return root or "."
+
+def output_name(file_path, root="."):
+    """Output path relative to the output folder, mirroring where the PDF sits under `root` so
+    PDFs of the same name in different folders keep apart, also in the manifest"""
+    return os.path.splitext(os.path.relpath(file_path, root))[0] + ".txt"
+
+def load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"version": EXTRACTOR_VERSION, "files": {}}
+
+def save_manifest(manifest, output_dir):
+    path = os.path.join(output_dir, MANIFEST)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{path}.tmp", path) # a crash mid-write keeps the previous manifest
+
+def is_completed(entry, file_hash, output_dir, exports=()):
+    return (
+        entry is not None
+        and entry["status"] == "done"
+        and entry["hash"] == file_hash
+        and entry["version"] == EXTRACTOR_VERSION
+        and not entry.get("degraded_pages") # pages over their time budget are retried on resume
+        and "store_error" not in entry
+        and set(exports) <= set(entry.get("export_formats", []))
+        and all(os.path.exists(os.path.join(output_dir, output)) for output in [entry["output"], *entry.get("exports", [])])
+    )
+
+def process_file(file_path, output, output_dir, file_hash, streaming=False, profile=False, layouts=None, budgets=(None, None), store=None, exports=()):
+    entry = {"file": file_path, "hash": file_hash, "version": EXTRACTOR_VERSION, "output": output}
+    if profile:
+        entry["profile"] = os.path.splitext(entry["output"])[0] + ".prof"
+    start = time.perf_counter()
+    try:
+        os.makedirs(os.path.dirname(os.path.join(output_dir, output)), exist_ok=True)
+        report = {}
+        comp_plan = extract_comp_plan_content(
+            file_path,
+            streaming=streaming,
+            report=report,
+            profile=os.path.join(output_dir, entry["profile"]) if profile else None,
+            layouts=LayoutProfiles(layouts) if layouts else None,
+            page_budget=budgets[0],
+            document_budget=budgets[1]
+        )
+        entry["extract_seconds"] = round(time.perf_counter() - start, 3)
+        entry["stages"] = report["stages"]
+        entry["page_classes"] = report["page_classes"]
+        entry["layout_profile_pages"] = report["layout_profile_pages"]
+        entry["degraded_pages"] = report["degraded_pages"]
+        render_start = time.perf_counter()
+        output_template_to_txt(iter_comp_plan_template(comp_plan), os.path.join(output_dir, entry["output"]))
+        entry["render_seconds"] = round(time.perf_counter() - render_start, 3)
+        if exports:
+            export_start = time.perf_counter()
+            paths = export_comp_plan(comp_plan, os.path.join(output_dir, os.path.splitext(entry["output"])[0]), exports)
+            entry["exports"] = [os.path.relpath(path, output_dir) for path in paths]
+            entry["export_formats"] = list(exports)
+            entry["export_seconds"] = round(time.perf_counter() - export_start, 3)
+        if store and not entry["degraded_pages"]:
+            try:
+                PlanStore(store).put(file_hash, os.path.basename(file_path), comp_plan)
+            except Exception as e:
+                # the outputs are written, the file is extracted and stored again on resume
+                entry["store_error"] = f"{type(e).__name__}: {e}"
+        entry["status"] = "done"
+    except Exception as e:
+        entry["status"] = "failed"
+        entry["error"] = f"{type(e).__name__}: {e}"
+    entry["seconds"] = round(time.perf_counter() - start, 3)
+    return entry
+
+def run_batch(source, output_dir, workers=None, force=False, streaming=False, profile=None, layouts=None, budgets=(None, None), store=None, exports=()):
+    """Extracts every PDF matched by `source` into `output_dir`, recording each file in the
+    manifest as soon as it finishes so a re-run skips the files already done"""
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    pending, skipped = [], 0
+    root = input_root(source)
+    for file_path in find_inputs(source):
+        file_hash = PlanCache.hash_file(file_path)
+        output = output_name(file_path, root)
+        if not force and is_completed(manifest["files"].get(output), file_hash, output_dir, exports):
+            skipped += 1
+            continue
+        pending.append((file_path, output, file_hash))
+
+    print(f"{len(pending)} to process, {skipped} already done")
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(process_file, file_path, output, output_dir, file_hash, streaming, os.path.basename(file_path) == profile, layouts, budgets, store, exports)
+            for file_path, output, file_hash in pending
+        ]
+        for done, future in enumerate(as_completed(futures), 1):
+            entry = future.result()
+            manifest["files"][entry["output"]] = entry
+            save_manifest(manifest, output_dir)
+            failed += entry["status"] == "failed"
+            print(f"[{done}/{len(pending)}] {entry['status']} {entry['file']} ({entry['seconds']}s){' - ' + entry['error'] if 'error' in entry else ''}{' - store failed: ' + entry['store_error'] if 'store_error' in entry else ''}")
+    return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract compensation plan PDFs to text without the web app")
+    parser.add_argument("source", help="folder of PDFs or a glob pattern such as 'plans/**/*.pdf'")
+    parser.add_argument("-o", "--output", default="output", help="folder for the .txt outputs, in the subfolders of their PDFs, and manifest.json")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--force", action="store_true", help="re-extract files already completed in the manifest")
+    parser.add_argument("--streaming", action="store_true", help="release each page after parsing to bound memory")
+    parser.add_argument("--profile", metavar="FILE_NAME", help="run cProfile on the PDF with this file name, stats go next to its output")
+    parser.add_argument("--layouts", metavar="PATH", help="JSON file of learned layout profiles to match pages against and extend")
+    parser.add_argument("--page-budget", type=float, metavar="SECONDS", help="parse pages taking longer with the text-only fallback")
+    parser.add_argument("--document-budget", type=float, metavar="SECONDS", help="parse the pages left after this long with the text-only fallback")
+    parser.add_argument("--store", metavar="PATH", help="also store the parsed plans in this SQLite file, query it with store.py")
+    parser.add_argument("--export", default="", metavar="FORMATS", help=f"also write these comma separated exports next to each .txt, from {', '.join(EXPORT_FORMATS)}")
+    args = parser.parse_args(argv)
+    budgets = (args.page_budget, args.document_budget)
+    exports = [export_format for export_format in args.export.split(",") if export_format]
+    if unknown := set(exports) - set(EXPORT_FORMATS):
+        parser.error(f"unknown export format {', '.join(sorted(unknown))}")
+    return 1 if run_batch(args.source, args.output, args.workers, args.force, args.streaming, args.profile, args.layouts, budgets, args.store, exports) else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
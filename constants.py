@@ -0,0 +1,7 @@
+# Kept apart from utils.py so the web layer reads them without importing the extraction stack
+
+# bump whenever a parser change alters the extracted `infos`, cached plans are keyed on it
+EXTRACTOR_VERSION = "1"
+
+# machine-oriented exports of utils.export_comp_plan
+EXPORT_FORMATS = ("jsonl", "parquet")
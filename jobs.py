@@ -0,0 +1,620 @@
+import atexit
+import multiprocessing
+import os
+import queue
+import re
+import shutil
+import signal
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields
+from multiprocessing.connection import Connection, wait as wait_connections
+from multiprocessing.reduction import recv_handle, send_handle
+from profiling import StageMetrics
+
+
+@dataclass
+class FileProgress:
+    name: str
+    status: str = "queued" # queued | running | rendering | done | failed
+    pages_done: int = 0
+    pages_total: int = None
+    output: str = None
+    error: str = None
+    cached: bool = False
+    peak_rss: int = None
+    stages: dict = field(default_factory=dict) # stage -> {"calls", "seconds"}, see StageTimings.write_report
+    pages: list = field(default_factory=list)
+    page_classes: dict = field(default_factory=dict) # PageScan class -> number of pages
+    layout_profile_pages: int = 0 # pages cropped straight from a learned layout profile
+    degraded_pages: list = field(default_factory=list) # pages parsed by the text-only fallback
+    profile: str = None # cProfile stats of this file, when it was profiled
+    exports: list = field(default_factory=list) # JSON Lines and Parquet files written next to the output
+
+    def update_pages(self, pages_done, pages_total):
+        self.pages_done, self.pages_total = pages_done, pages_total
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "status": self.status,
+            "pagesDone": self.pages_done,
+            "pagesTotal": self.pages_total,
+            "output": self.output,
+            "error": self.error,
+            "cached": self.cached,
+            "peakRss": self.peak_rss,
+            "stages": self.stages,
+            "pages": self.pages,
+            "pageClasses": self.page_classes,
+            "layoutProfilePages": self.layout_profile_pages,
+            "degradedPages": self.degraded_pages,
+            "profile": self.profile,
+            "exports": self.exports
+        }
+
+@dataclass
+class Job:
+    job_id: str
+    folder: str
+    files: list[FileProgress]
+    created: float = field(default_factory=time.time)
+    finished: float = None
+
+    @property
+    def status(self):
+        statuses = {file.status for file in self.files}
+        if statuses <= {"done", "failed"}:
+            return "failed" if statuses == {"failed"} else "done"
+        return "queued" if statuses == {"queued"} else "running"
+
+    @property
+    def finished_files(self):
+        return [file for file in self.files if file.status == "done"]
+
+    def get_file(self, output):
+        return next((file for file in self.files if output in (file.output, os.path.splitext(file.name)[0] + ".txt", file.profile) or output in file.exports), None)
+
+    def to_dict(self):
+        return {
+            "jobId": self.job_id,
+            "status": self.status,
+            "pagesDone": sum(file.pages_done for file in self.files),
+            "pagesTotal": sum(file.pages_total or 0 for file in self.files),
+            "files": [file.to_dict() for file in self.files]
+        }
+
+class ZipStream:
+    """Write-only file object handed to ZipFile, buffering the compressed bytes until the
+    generator driving the archive hands them out. ZipFile falls back to data descriptors when
+    the target cannot seek, so the archive never touches the disk"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def iter_zip(folder, file_names, chunk_size=64 * 1024):
+    """Yields a deflated ZIP of `file_names` from `folder` chunk by chunk"""
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED) as zip:
+        for file_name in file_names:
+            with open(os.path.join(folder, file_name), "rb") as src, zip.open(file_name, "w") as dst:
+                for chunk in iter(lambda: src.read(chunk_size), b""):
+                    dst.write(chunk)
+                    if data := stream.pop():
+                        yield data
+            if data := stream.pop():
+                yield data
+    if data := stream.pop():
+        yield data
+
+@dataclass
+class FileProcessor:
+    """Extracts, renders, exports and stores one uploaded PDF with the settings of a JobQueue, in
+    the job thread or in an extraction worker holding a pickled copy of it. The extraction stack
+    is only imported here, so the web layer starts without it"""
+    extract_workers: int = None
+    cache: object = None
+    page_cache: object = None
+    shared_tables: bool = False
+    streaming: bool = False
+    memory_limit: int = None
+    layouts: object = None
+    page_budget: float = None
+    document_budget: float = None
+    store: object = None
+    exports: tuple = ()
+
+    def extract(self, file_path, file, metrics):
+        from utils import extract_comp_plan_content
+
+        def extract(file_path):
+            report = {}
+            comp_plan = extract_comp_plan_content(
+                file_path,
+                workers=self.extract_workers,
+                progress=file.update_pages,
+                page_cache=self.page_cache,
+                shared_tables=self.shared_tables,
+                streaming=self.streaming,
+                memory_limit=self.memory_limit,
+                report=report,
+                profile=os.path.join(os.path.dirname(file_path), file.profile) if file.profile else None,
+                layouts=self.layouts,
+                page_budget=self.page_budget,
+                document_budget=self.document_budget
+            )
+            file.peak_rss = report.get("peak_rss")
+            file.stages, file.pages, file.page_classes = report["stages"], report["pages"], report["page_classes"]
+            file.layout_profile_pages = report["layout_profile_pages"]
+            file.degraded_pages = report["degraded_pages"]
+            metrics.record(file.stages, pages=len(file.pages))
+            return comp_plan
+
+        if self.cache is None or file.profile:
+            comp_plan = extract(file_path)
+            if self.cache is not None and not file.degraded_pages:
+                self.cache.put(self.cache.key(file_path), comp_plan)
+            return comp_plan
+        # a plan with pages over their time budget is incomplete, the next upload extracts it again
+        comp_plan, file.cached = self.cache.get_or_extract(file_path, extract, keep=lambda comp_plan: not file.degraded_pages)
+        return comp_plan
+
+    def process(self, file_path, file, metrics):
+        """Everything but marking the file done or failed, which is left to the job thread"""
+        from utils import export_comp_plan, iter_comp_plan_template, output_template_to_txt
+
+        comp_plan = self.extract(file_path, file, metrics)
+        file.status = "rendering"
+        folder = os.path.dirname(file_path)
+        output = os.path.splitext(file.name)[0] + ".txt"
+        start = time.perf_counter()
+        output_template_to_txt(iter_comp_plan_template(comp_plan), os.path.join(folder, output))
+        render = {"render": {"calls": 1, "seconds": round(time.perf_counter() - start, 6)}}
+        if self.exports:
+            start = time.perf_counter()
+            paths = export_comp_plan(comp_plan, os.path.join(folder, os.path.splitext(output)[0]), self.exports)
+            file.exports = [os.path.basename(path) for path in paths]
+            render["export"] = {"calls": 1, "seconds": round(time.perf_counter() - start, 6)}
+        file.stages = {**file.stages, **render}
+        metrics.record(render, documents=0)
+        if self.store is not None and not file.degraded_pages:
+            try:
+                self.store.put_file(file_path, comp_plan)
+            except Exception as e:
+                # the outputs are written, a plan missing from the store does not fail the file
+                print(f"Storing {file.name} failed: {type(e).__name__}: {e}")
+                metrics.record_store_failure()
+        file.output = output
+
+    def lookups(self):
+        """(hits, misses) of the plan and page caches"""
+        return [(cache.hits, cache.misses) if cache is not None else (0, 0) for cache in (self.cache, self.page_cache)]
+
+class ExtractionWorkerError(RuntimeError):
+    pass
+
+class ForwardedFileProgress(FileProgress):
+    """FileProgress of a file processed in an extraction worker, its page progress and status
+    changes are sent to the job thread of the file as they happen"""
+    conn = None
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name == "status" and self.conn is not None:
+            self.conn.send(("status", value))
+
+    def update_pages(self, pages_done, pages_total):
+        super().update_pages(pages_done, pages_total)
+        self.conn.send(("pages", pages_done, pages_total))
+
+class ForwardedMetrics:
+    """StageMetrics of an extraction worker, every record goes to the job thread's StageMetrics"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def record(self, stages, pages=0, documents=1):
+        self.conn.send(("metrics", stages, pages, documents))
+
+    def record_store_failure(self):
+        self.conn.send(("store_failure",))
+
+# FileProgress fields a worker sends back once a file is processed, the rest belong to the job thread
+RESULT_FIELDS = [field.name for field in fields(FileProgress) if field.name not in ("name", "status", "profile")]
+
+def _extraction_worker(conn, ready_conn, processor, parent_conns=()):
+    """Main of an extraction worker: imports and warms up the extraction stack once, reports the
+    seconds it took on `ready_conn`, then processes the files sent on `conn` until it gets None"""
+    start = time.perf_counter()
+    for parent_conn in parent_conns:
+        parent_conn.close() # the pool's ends, so this worker sees the pool go away as EOFError
+    if hasattr(os, "setpgid"):
+        os.setpgid(0, 0) # own process group, so the page workers it starts go down with it
+        # nor do they keep the pipe open, the job thread sees this worker die as EOFError
+        os.register_at_fork(after_in_child=conn.close)
+    from utils import warm_up
+    warm_up()
+    ready_conn.send(time.perf_counter() - start)
+    ready_conn.close()
+    metrics = ForwardedMetrics(conn)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        conn.send(("started",))
+        file_path, name, profile = task
+        file = ForwardedFileProgress(name, profile=profile)
+        file.conn = conn
+        before = processor.lookups()
+        try:
+            processor.process(file_path, file, metrics)
+            error = None
+        except Exception as e:
+            error = str(e)
+        file.conn = None
+        lookups = [(hits - hits_before, misses - misses_before) for (hits, misses), (hits_before, misses_before) in zip(processor.lookups(), before)]
+        conn.send(("finished", error, {name: getattr(file, name) for name in RESULT_FIELDS}, lookups))
+
+def _worker_spawner(conn, processor, parent_conn):
+    """Main of the process starting the extraction workers. It is forked with the pool while the app
+    runs no threads yet, so no worker is ever forked from a process whose other threads may hold
+    the import, logging or allocator locks. Each message on `conn` starts one worker, its pid and
+    the pool's ends of its pipes go back on `conn`. Exited workers are reaped here"""
+    parent_conn.close()
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl-C stops the app, which stops this process
+    os.register_at_fork(after_in_child=conn.close)
+    context = multiprocessing.get_context("fork")
+    workers = {}
+    while True:
+        for ready in wait_connections([conn, *workers]):
+            if ready is not conn:
+                workers.pop(ready).join()
+                continue
+            try:
+                message = conn.recv()
+            except EOFError:
+                message = None
+            if message is None:
+                for process in workers.values():
+                    process.join(timeout=5)
+                    if process.is_alive():
+                        process.kill()
+                        process.join()
+                return
+            worker_conn, child_conn = context.Pipe()
+            ready_conn, child_ready_conn = context.Pipe(duplex=False)
+            # not a daemon, the budgets and page workers of extract_comp_plan_content start processes of their own
+            process = context.Process(target=_extraction_worker, args=(child_conn, child_ready_conn, processor, (worker_conn, ready_conn)), name="extraction-worker")
+            process.start()
+            child_conn.close()
+            child_ready_conn.close()
+            workers[process.sentinel] = process
+            conn.send(process.pid)
+            for handle_conn in (worker_conn, ready_conn):
+                send_handle(conn, handle_conn.fileno(), os.getppid())
+                handle_conn.close()
+
+class ExtractionPool:
+    """Resident extraction worker processes. A spawner process is forked as the app starts, while
+    the web layer has not loaded the extraction stack and runs no threads yet, and forks every
+    worker, the first ones and the replacements alike. Each worker imports and warms up the stack
+    once and is handed out once warm, a job thread checks one out per file and relays its progress.
+    A worker that dies is replaced, and a file whose worker died before taking it goes to another
+    worker. Startup and warm up times go to `metrics` as gauges"""
+
+    # workers dying one after the other while warming up, after which the pool fails its jobs
+    max_warm_up_failures = 3
+    # seconds a job waits for a free worker before it fails
+    checkout_timeout = 600
+
+    def __init__(self, processes, processor, metrics=None):
+        # fork rather than spawn or forkserver, which would import the app module again in every worker
+        context = multiprocessing.get_context("fork")
+        self.processor = processor
+        self.metrics = metrics
+        self.idle = queue.Queue()
+        self.workers = set() # (pid, conn)
+        self.lock = threading.Lock()
+        self.spawner_lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.warm_up_seconds = []
+        self.warm_up_failures = 0
+        self.error = None
+        self.closed = False
+        self.ready_seconds = None
+        self.spawner_conn, child_conn = context.Pipe()
+        self.spawner = context.Process(target=_worker_spawner, args=(child_conn, processor, self.spawner_conn), name="extraction-spawner")
+        self.spawner.start()
+        child_conn.close()
+        starting = dict(self.start_worker() for _ in range(processes))
+        threading.Thread(target=self.wait_ready, args=(starting, True), name="extraction-warm-up", daemon=True).start()
+        atexit.register(self.close)
+
+    def start_worker(self):
+        """Has the spawner fork a worker, returns its ready pipe and the worker"""
+        with self.spawner_lock:
+            self.spawner_conn.send("start")
+            pid = self.spawner_conn.recv()
+            conn = Connection(recv_handle(self.spawner_conn))
+            ready_conn = Connection(recv_handle(self.spawner_conn), writable=False)
+        worker = (pid, conn)
+        with self.lock:
+            self.workers.add(worker)
+        return ready_conn, worker
+
+    def wait_ready(self, starting, initial=False):
+        """Hands out the workers of `starting` (ready pipe -> worker) as they get warm"""
+        pending = dict(starting)
+        while pending:
+            for ready_conn in wait_connections(list(pending)):
+                worker = pending.pop(ready_conn)
+                try:
+                    seconds = ready_conn.recv()
+                except EOFError:
+                    self.warm_up_failed(worker)
+                    continue
+                finally:
+                    ready_conn.close()
+                with self.lock:
+                    self.warm_up_seconds.append(seconds)
+                    self.warm_up_failures = 0
+                self.idle.put(worker)
+                if self.metrics is not None:
+                    self.metrics.set_gauge("worker_warm_up_seconds", max(self.warm_up_seconds), "Slowest extraction worker import and warm up")
+        if initial:
+            self.ready_seconds = time.perf_counter() - self.started
+            if self.metrics is not None:
+                self.metrics.set_gauge("workers_ready_seconds", self.ready_seconds, "Seconds from starting the extraction workers until all of them were warm")
+
+    def warm_up_failed(self, worker):
+        """A worker died while warming up, it never reached `idle` so no job sees it"""
+        with self.lock:
+            self.warm_up_failures += 1
+            failures = self.warm_up_failures
+        if failures < self.max_warm_up_failures:
+            self.replace(worker)
+            return
+        self.discard(worker)
+        self.fail(f"Extraction workers exited while warming up {failures} times in a row")
+
+    def fail(self, error):
+        """Fails the pool for good, every waiting and later job fails with `error`"""
+        if self.error is None:
+            self.error = error
+        self.close()
+
+    def discard(self, worker):
+        pid, conn = worker
+        with self.lock:
+            self.workers.discard(worker)
+        conn.close()
+        if hasattr(os, "killpg"):
+            try:
+                os.killpg(pid, signal.SIGKILL) # the worker and any page workers it left behind, the spawner reaps it
+            except (ProcessLookupError, PermissionError):
+                pass
+
+    def replace(self, worker):
+        self.discard(worker)
+        try:
+            starting = dict([self.start_worker()])
+        except (EOFError, OSError):
+            if not self.closed:
+                self.fail("Extraction worker spawner exited")
+            return
+        threading.Thread(target=self.wait_ready, args=(starting,), name="extraction-warm-up", daemon=True).start()
+
+    def checkout(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        while self.error is None:
+            try:
+                # wakes every second to notice a failed pool or a dead spawner
+                worker = self.idle.get(timeout=min(1, max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                if not self.closed and not self.spawner.is_alive():
+                    self.fail("Extraction worker spawner exited")
+                elif time.monotonic() >= deadline:
+                    raise ExtractionWorkerError(f"No extraction worker was free within {self.checkout_timeout} seconds")
+                continue
+            try:
+                if not worker[1].poll():
+                    return worker
+            except OSError:
+                pass # closed by a failed pool
+            self.replace(worker) # an idle worker sends nothing, so a readable pipe means it died
+        raise ExtractionWorkerError(self.error)
+
+    def process(self, file_path, file, metrics):
+        """FileProcessor.process of `file` in the next free worker"""
+        while True:
+            worker = self.checkout()
+            conn = worker[1]
+            started = False
+            try:
+                conn.send((file_path, file.name, file.profile))
+                while True:
+                    message = conn.recv()
+                    if message[0] == "started":
+                        started = True
+                    elif message[0] == "pages":
+                        file.update_pages(*message[1:])
+                    elif message[0] == "status":
+                        file.status = message[1]
+                    elif message[0] == "metrics":
+                        metrics.record(*message[1:])
+                    elif message[0] == "store_failure":
+                        metrics.record_store_failure()
+                    else:
+                        _, error, result, lookups = message
+                        break
+            except (EOFError, OSError):
+                self.replace(worker)
+                if started:
+                    raise ExtractionWorkerError(f"Extraction worker died while processing {file.name}")
+                continue # the worker died before it took the file, so the file is not to blame
+            break
+        self.idle.put(worker)
+        for name, value in result.items():
+            setattr(file, name, value)
+        for cache, (hits, misses) in zip((self.processor.cache, self.processor.page_cache), lookups):
+            if cache is not None:
+                cache.record(hits, misses)
+        if error is not None:
+            raise ExtractionWorkerError(error)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "processes": len(self.workers),
+                "warm": len(self.warm_up_seconds),
+                "warmUpSeconds": [round(seconds, 3) for seconds in self.warm_up_seconds],
+                "readySeconds": None if self.ready_seconds is None else round(self.ready_seconds, 3)
+            }
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            workers, self.workers = list(self.workers), set()
+        for _, conn in workers:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            conn.close()
+        with self.spawner_lock:
+            try:
+                self.spawner_conn.send(None) # joins the workers, then exits
+            except OSError:
+                pass
+            self.spawner_conn.close()
+        self.spawner.join(timeout=10)
+        if self.spawner.is_alive():
+            self.spawner.kill()
+            self.spawner.join()
+        for worker in workers:
+            self.discard(worker)
+
+class JobQueue:
+    """Runs extraction jobs on a local background pool, one task per uploaded file so a slow
+    file does not hold back the files queued behind it. Every job works in its own folder under
+    `workspace`, which a sweeper removes together with the job once it has been finished for
+    `ttl` seconds. With `processes` the files are processed in that many resident ExtractionPool
+    workers, otherwise in the job threads themselves"""
+
+    JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+    def __init__(self, max_workers=None, extract_workers=None, cache=None, page_cache=None, shared_tables=False, streaming=False, memory_limit=None, workspace="uploads", ttl=3600, sweep_interval=60, layouts=None, page_budget=None, document_budget=None, store=None, exports=(), processes=0):
+        self.workspace = workspace
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.processor = FileProcessor(extract_workers, cache, page_cache, shared_tables, streaming, memory_limit, layouts, page_budget, document_budget, store, exports)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.metrics = StageMetrics()
+        self.first_job_seconds = None
+        os.makedirs(workspace, exist_ok=True)
+        # started before any thread of this queue so the worker spawner is forked from a single threaded process
+        self.pool = ExtractionPool(processes, self.processor, self.metrics) if processes else None
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="extract")
+        if ttl is not None:
+            threading.Thread(target=self.run_sweeper, name="job-sweeper", daemon=True).start()
+
+    def new_job_id(self):
+        return uuid.uuid4().hex
+
+    def new_workspace(self, job_id):
+        folder = os.path.join(self.workspace, job_id)
+        os.makedirs(folder)
+        return folder
+
+    def submit(self, job_id, folder, file_names, profile=None):
+        """`profile` names one of the files to extract under cProfile, bypassing the plan cache"""
+        job = Job(job_id, folder, [FileProgress(file_name) for file_name in file_names])
+        for file in job.files:
+            if file.name == profile:
+                file.profile = os.path.splitext(file.name)[0] + ".prof"
+        with self.lock:
+            self.jobs[job_id] = job
+        for file in job.files:
+            self.executor.submit(self.run_file, job, file)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def sweep(self, now=None):
+        """Drops finished jobs older than the ttl along with their workspace, plus job folders
+        left behind by a previous process. Returns the removed job ids"""
+        now = time.time() if now is None else now
+        with self.lock:
+            expired = [job for job in self.jobs.values() if job.finished is not None and now - job.finished > self.ttl]
+            for job in expired:
+                del self.jobs[job.job_id]
+            active = set(self.jobs)
+        for job in expired:
+            shutil.rmtree(job.folder, ignore_errors=True)
+        removed = [job.job_id for job in expired]
+        for name in os.listdir(self.workspace):
+            folder = os.path.join(self.workspace, name)
+            if name in active or not self.JOB_ID.fullmatch(name) or not os.path.isdir(folder):
+                continue
+            try:
+                if now - os.path.getmtime(folder) > self.ttl:
+                    shutil.rmtree(folder, ignore_errors=True)
+                    removed.append(name)
+            except FileNotFoundError:
+                continue
+        return removed
+
+    def run_sweeper(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(e)
+            time.sleep(self.sweep_interval)
+
+    def run_file(self, job, file):
+        file.status = "running"
+        file_path = os.path.join(job.folder, file.name)
+        try:
+            if self.pool is not None:
+                self.pool.process(file_path, file, self.metrics)
+            else:
+                self.processor.process(file_path, file, self.metrics)
+            file.status = "done"
+        except Exception as e:
+            print(e)
+            file.error = str(e)
+            file.status = "failed"
+            self.metrics.record_failure()
+        if job.status in ("done", "failed"):
+            job.finished = time.time()
+            if self.first_job_seconds is None:
+                # first-request latency, includes any warm up still running when the job came in
+                self.first_job_seconds = job.finished - job.created
+                self.metrics.set_gauge("first_job_seconds", self.first_job_seconds, "Seconds from submitting the first job until it finished")
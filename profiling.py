@@ -0,0 +1,178 @@
+import contextvars
+import cProfile
+import functools
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+
+# StageTimings of the document being extracted in the current thread, None when nothing is timed
+_current_timings = contextvars.ContextVar("current_timings", default=None)
+
+
+@dataclass
+class StageTimings:
+    """Wall time and call count of every stage of one document, with the same breakdown kept
+    per page. Stages nest, so each stage's time includes the stages it calls"""
+    stages: dict = field(default_factory=dict) # stage -> [calls, seconds]
+    pages: dict = field(default_factory=dict) # page index -> {stage -> [calls, seconds]}
+    current_page: int = None
+
+    def add(self, stage, seconds, calls=1):
+        self._add(self.stages, stage, seconds, calls)
+        if self.current_page is not None:
+            self._add(self.pages.setdefault(self.current_page, {}), stage, seconds, calls)
+
+    @staticmethod
+    def _add(stages, stage, seconds, calls):
+        totals = stages.setdefault(stage, [0, 0.0])
+        totals[0] += calls
+        totals[1] += seconds
+
+    def add_page(self, index, stages):
+        """Folds in the stages of a page timed elsewhere, e.g. in a worker process"""
+        previous, self.current_page = self.current_page, index
+        for stage, (calls, seconds) in stages.items():
+            self.add(stage, seconds, calls)
+        self.current_page = previous
+
+    @contextmanager
+    def stage(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    @contextmanager
+    def page(self, index):
+        previous, self.current_page = self.current_page, index
+        try:
+            with self.stage("page"):
+                yield
+        finally:
+            self.current_page = previous
+
+    @contextmanager
+    def activate(self):
+        token = _current_timings.set(self)
+        try:
+            yield self
+        finally:
+            _current_timings.reset(token)
+
+    @staticmethod
+    def stages_to_dict(stages):
+        return {stage: {"calls": calls, "seconds": round(seconds, 6)} for stage, (calls, seconds) in stages.items()}
+
+    def write_report(self, report):
+        if report is not None:
+            report["stages"] = self.stages_to_dict(self.stages)
+            report["pages"] = [
+                {"page": index, "seconds": round(stages.get("page", (0, 0.0))[1], 6), "stages": self.stages_to_dict(stages)}
+                for index, stages in sorted(self.pages.items())
+            ]
+
+def current_timings():
+    return _current_timings.get()
+
+def timed(func):
+    """Records each call of `func` as a stage named after it, when a document is being timed"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if (timings := _current_timings.get()) is None:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings.add(func.__name__, time.perf_counter() - start)
+    return wrapper
+
+def stage(name):
+    """Context manager timing a block as stage `name`, a no-op when nothing is timed"""
+    if (timings := _current_timings.get()) is None:
+        return nullcontext()
+    return timings.stage(name)
+
+@contextmanager
+def profiled(path):
+    """Runs the block under cProfile and dumps the stats to `path`, does nothing when `path` is None.
+    Only the calling thread is profiled, pages parsed in worker processes are not included"""
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+class StageMetrics:
+    """Process-wide totals of the stage timings of every extracted document, plus a few gauges
+    such as the startup times, rendered in the Prometheus text exposition format"""
+
+    def __init__(self, prefix="complan"):
+        self.prefix = prefix
+        self.stages = {}
+        self.documents = 0
+        self.pages = 0
+        self.failures = 0
+        self.store_failures = 0
+        self.gauges = {} # name -> (help, value)
+        self.lock = threading.Lock()
+
+    def record(self, stages, pages=0, documents=1):
+        """`stages` as written to a report, {stage: {"calls": calls, "seconds": seconds}}"""
+        with self.lock:
+            self.documents += documents
+            self.pages += pages
+            for name, totals in stages.items():
+                StageTimings._add(self.stages, name, totals["seconds"], totals["calls"])
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+
+    def record_store_failure(self):
+        with self.lock:
+            self.store_failures += 1
+
+    def set_gauge(self, name, value, help):
+        with self.lock:
+            self.gauges[name] = (help, value)
+
+    def to_prometheus(self):
+        prefix = self.prefix
+        with self.lock:
+            lines = [
+                f"# HELP {prefix}_documents_total Documents extracted",
+                f"# TYPE {prefix}_documents_total counter",
+                f"{prefix}_documents_total {self.documents}",
+                f"# HELP {prefix}_pages_total Pages parsed",
+                f"# TYPE {prefix}_pages_total counter",
+                f"{prefix}_pages_total {self.pages}",
+                f"# HELP {prefix}_failures_total Documents that failed to extract or render",
+                f"# TYPE {prefix}_failures_total counter",
+                f"{prefix}_failures_total {self.failures}",
+                f"# HELP {prefix}_store_failures_total Extracted documents the plan store failed to write",
+                f"# TYPE {prefix}_store_failures_total counter",
+                f"{prefix}_store_failures_total {self.store_failures}",
+                f"# HELP {prefix}_stage_seconds_total Wall time spent in each stage",
+                f"# TYPE {prefix}_stage_seconds_total counter",
+            ]
+            lines.extend(f'{prefix}_stage_seconds_total{{stage="{name}"}} {seconds:.6f}' for name, (_, seconds) in sorted(self.stages.items()))
+            lines.extend([
+                f"# HELP {prefix}_stage_calls_total Calls of each stage",
+                f"# TYPE {prefix}_stage_calls_total counter",
+            ])
+            lines.extend(f'{prefix}_stage_calls_total{{stage="{name}"}} {calls}' for name, (calls, _) in sorted(self.stages.items()))
+            for name, (help, value) in sorted(self.gauges.items()):
+                lines.extend([
+                    f"# HELP {prefix}_{name} {help}",
+                    f"# TYPE {prefix}_{name} gauge",
+                    f"{prefix}_{name} {value:.6f}",
+                ])
+        return "\n".join(lines) + "\n"
@@ -5,7 +5,16 @@ function createFileElement(fileName, index) {
     // const fileContainer = document.querySelector(".file");
     const file = document.createElement("div");
     file.classList.add("file");
-    file.innerHTML = `<p class="file-name">${fileName}<span class="cancel-button" data-index="${index}">X</span></p>`;
+    // built with textContent, file names and error messages are not trusted HTML
+    const name = document.createElement("p");
+    name.classList.add("file-name");
+    name.textContent = fileName;
+    const cancel = document.createElement("span");
+    cancel.classList.add("cancel-button");
+    cancel.dataset.index = index;
+    cancel.textContent = "X";
+    name.appendChild(cancel);
+    file.appendChild(name);
     return file;
 }
 
@@ -47,6 +56,7 @@ window.addEventListener("load", () => {
 function extractContent() {
     const formData = new FormData();
     const outputContainer = document.querySelector("#output-container");
+    const progressContainer = document.querySelector(".progress-bar-container");
 
     fileObjs.forEach((file) => {
         formData.append("files", file);
@@ -63,17 +73,49 @@ function extractContent() {
             const convertedFiles = document.querySelector(".files-ready-to-download");
             convertedFiles.innerHTML = ""; // Clear previous entries
 
-            const convertedFileNames = data.convertedFiles;
-            const downloadDir = data.download_dir;
             const downloadButton = document.querySelector("#download-button");
+            downloadButton.href = data.download_dir;
 
-            outputContainer.style.display = "block";
+            progressContainer.style.display = "block";
+            pollJob(data.status_url);
+        });
+}
 
-            convertedFileNames.forEach((fileName) => {
-                const file = createFileElement(fileName);
-                convertedFiles.appendChild(file);
-            });
+function pollJob(statusUrl) {
+    const outputContainer = document.querySelector("#output-container");
+    const progressContainer = document.querySelector(".progress-bar-container");
+    const progress = document.querySelector(".progress");
+    const progressText = document.querySelector(".progress-text");
+    const convertedFiles = document.querySelector(".files-ready-to-download");
 
-            downloadButton.href = downloadDir;
+    fetch(statusUrl)
+        .then(response => response.json())
+        .then(job => {
+            const percent = job.pagesTotal ? Math.round(100 * job.pagesDone / job.pagesTotal) : 0;
+            progress.style.width = `${percent}%`;
+            progressText.textContent = `${job.pagesDone} / ${job.pagesTotal} pages`;
+
+            convertedFiles.innerHTML = ""; // Re-render finished files
+            job.files.forEach((fileInfo) => {
+                if (fileInfo.status === "done") {
+                    const file = createFileElement(fileInfo.output);
+                    const link = document.createElement("a");
+                    link.href = `${statusUrl}/files/${encodeURIComponent(fileInfo.output)}`;
+                    link.textContent = "download";
+                    file.querySelector(".file-name").append(" ", link);
+                    convertedFiles.appendChild(file);
+                } else if (fileInfo.status === "failed") {
+                    convertedFiles.appendChild(createFileElement(`${fileInfo.name} failed: ${fileInfo.error}`));
+                }
+            });
+            if (convertedFiles.children.length > 0) {
+                outputContainer.style.display = "block";
+            }
+
+            if (job.status === "queued" || job.status === "running") {
+                setTimeout(() => pollJob(statusUrl), 1000);
+            } else {
+                progressContainer.style.display = "none";
+            }
         });
 }
@@ -0,0 +1,331 @@
+import json
+import math
+import os
+import sqlite3
+import time
+from contextlib import closing
+from cache import PlanCache
+from constants import EXTRACTOR_VERSION
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    title TEXT,
+    version TEXT NOT NULL,
+    stored REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS role_availability (
+    document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    role_group TEXT NOT NULL,
+    role TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS roles (
+    id INTEGER PRIMARY KEY,
+    document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    title TEXT COLLATE NOCASE,
+    gate_text TEXT,
+    quota_cadence TEXT,
+    unbalanced TEXT,
+    other_information TEXT,
+    degraded INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS metric_buckets (
+    role_id INTEGER NOT NULL REFERENCES roles(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    bucket TEXT,
+    weightage TEXT
+);
+CREATE TABLE IF NOT EXISTS pay_curves (
+    role_id INTEGER NOT NULL REFERENCES roles(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    attainment TEXT,
+    payout TEXT
+);
+CREATE TABLE IF NOT EXISTS attainment_modifiers (
+    role_id INTEGER NOT NULL REFERENCES roles(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    product TEXT COLLATE NOCASE,
+    modifier TEXT
+);
+CREATE TABLE IF NOT EXISTS eligibility_tables (
+    id INTEGER PRIMARY KEY,
+    document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    columns TEXT NOT NULL,
+    degraded INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS role_eligibility (
+    role_id INTEGER NOT NULL REFERENCES roles(id) ON DELETE CASCADE,
+    table_id INTEGER NOT NULL REFERENCES eligibility_tables(id) ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS eligibility_rows (
+    table_id INTEGER NOT NULL REFERENCES eligibility_tables(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    product TEXT COLLATE NOCASE,
+    cells TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_title ON documents(title);
+CREATE INDEX IF NOT EXISTS role_availability_document ON role_availability(document_id);
+CREATE INDEX IF NOT EXISTS roles_document ON roles(document_id);
+CREATE INDEX IF NOT EXISTS roles_title ON roles(title);
+CREATE INDEX IF NOT EXISTS metric_buckets_role ON metric_buckets(role_id);
+CREATE INDEX IF NOT EXISTS pay_curves_role ON pay_curves(role_id);
+CREATE INDEX IF NOT EXISTS attainment_modifiers_role ON attainment_modifiers(role_id);
+CREATE INDEX IF NOT EXISTS attainment_modifiers_product ON attainment_modifiers(product);
+CREATE INDEX IF NOT EXISTS eligibility_tables_document ON eligibility_tables(document_id);
+CREATE INDEX IF NOT EXISTS role_eligibility_role ON role_eligibility(role_id);
+CREATE INDEX IF NOT EXISTS role_eligibility_table ON role_eligibility(table_id);
+CREATE INDEX IF NOT EXISTS eligibility_rows_table ON eligibility_rows(table_id);
+CREATE INDEX IF NOT EXISTS eligibility_rows_product ON eligibility_rows(product);
+"""
+
+
+def cell_value(value):
+    """Eligibility cells as JSON friendly strings, empty cells as None"""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return str(value)
+
+def product_column(columns):
+    """Index of the column holding the product, the first one named like it or else the last"""
+    for idx, column in enumerate(columns):
+        if "product" in str(column).lower():
+            return idx
+    return len(columns) - 1
+
+def like_prefix(text):
+    """LIKE pattern matching the strings starting with `text`, a literal prefix lets SQLite search the index"""
+    if text is None:
+        return None
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+class PlanStore:
+    """SQLite store of parsed plans (the `infos` of extract_comp_plan_content) broken into roles,
+    metric bucket weightages, pay curves, attainment modifiers and product eligibility rows, indexed
+    on document, role title and product so plans can be queried without going back to the PDFs.
+    A document is keyed by its content hash and replaced when stored again by another extractor version"""
+
+    def __init__(self, path, version=EXTRACTOR_VERSION):
+        self.path = path
+        self.version = version
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(self.connect()) as db:
+            db.execute("PRAGMA journal_mode=WAL") # readers are not blocked while a plan is written
+            db.executescript(SCHEMA)
+
+    def connect(self):
+        """A connection per call keeps the store usable from the job threads and worker processes,
+        use it as `with closing(store.connect()) as db, db:` to commit and close"""
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA foreign_keys=ON")
+        return db
+
+    def has(self, file_hash):
+        """Whether this version of the document is stored in full, one with pages parsed by the
+        text-only fallback is replaced by the next complete extraction"""
+        with closing(self.connect()) as db:
+            row = db.execute(
+                "SELECT version, "
+                "EXISTS (SELECT 1 FROM roles WHERE document_id = documents.id AND degraded) "
+                "OR EXISTS (SELECT 1 FROM eligibility_tables WHERE document_id = documents.id AND degraded) AS degraded "
+                "FROM documents WHERE hash = ?",
+                (file_hash,)
+            ).fetchone()
+        return row is not None and row["version"] == self.version and not row["degraded"]
+
+    def put_file(self, file, comp_plan, name=None):
+        """Stores the plan extracted from the PDF `file` unless this version of it is stored in full already.
+        Returns the document id, or None when it was already stored"""
+        file_hash = PlanCache.hash_file(file)
+        if self.has(file_hash):
+            return None
+        return self.put(file_hash, name or os.path.basename(file), comp_plan)
+
+    def put(self, file_hash, name, comp_plan):
+        from utils import iter_comp_plan_sections # only the extraction workers write plans
+        with closing(self.connect()) as db, db:
+            db.execute("DELETE FROM documents WHERE hash = ?", (file_hash,))
+            document_id = db.execute(
+                "INSERT INTO documents (hash, name, version, stored) VALUES (?, ?, ?, ?)",
+                (file_hash, name, self.version, time.time())
+            ).lastrowid
+            role_position = table_position = 0
+            role_ids = {}
+            for section in iter_comp_plan_sections(comp_plan):
+                if section["section"] == "document":
+                    db.execute("UPDATE documents SET title = ? WHERE id = ?", (section["title"], document_id))
+                    db.executemany(
+                        "INSERT INTO role_availability (document_id, role_group, role) VALUES (?, ?, ?)",
+                        [(document_id, group, role) for group, roles in section["roles_availability"].items() for role in roles]
+                    )
+                elif section["section"] == "role":
+                    role_id = db.execute(
+                        "INSERT INTO roles (document_id, position, title, gate_text, quota_cadence, unbalanced, other_information, degraded) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (document_id, role_position, section["title"], section["gate_text"], section["quota_cadence"],
+                         section["unbalanced"], section["other_information"], section["degraded"])
+                    ).lastrowid
+                    role_position += 1
+                    role_ids[section["title"]] = role_id
+                    for table, rows in (("metric_buckets", section["metric_buckets"]), ("pay_curves", section["pay_curve"]), ("attainment_modifiers", section["attainment_modifiers"].values.tolist())):
+                        db.executemany(
+                            f"INSERT INTO {table} VALUES (?, ?, ?, ?)",
+                            [(role_id, position, *(cell_value(value) for value in row[:2])) for position, row in enumerate(rows)]
+                        )
+                else:
+                    for df in section["tables"]:
+                        columns = [cell_value(column) for column in df.columns]
+                        table_id = db.execute(
+                            "INSERT INTO eligibility_tables (document_id, position, columns, degraded) VALUES (?, ?, ?, ?)",
+                            (document_id, table_position, json.dumps(columns), section["degraded"])
+                        ).lastrowid
+                        table_position += 1
+                        db.executemany(
+                            "INSERT INTO role_eligibility (role_id, table_id) VALUES (?, ?)",
+                            [(role_ids[title], table_id) for title in section["roles"]]
+                        )
+                        product_idx = product_column(columns)
+                        rows = [[cell_value(value) for value in row] for row in df.itertuples(index=False)]
+                        db.executemany(
+                            "INSERT INTO eligibility_rows (table_id, position, product, cells) VALUES (?, ?, ?, ?)",
+                            [(table_id, position, row[product_idx] if row else None, json.dumps(row)) for position, row in enumerate(rows)]
+                        )
+        return document_id
+
+    def remove(self, file_hash):
+        with closing(self.connect()) as db, db:
+            return db.execute("DELETE FROM documents WHERE hash = ?", (file_hash,)).rowcount > 0
+
+    def documents(self, title=None):
+        """Stored documents, newest first, optionally those whose title contains `title`"""
+        where, params = self.filters(document=title)
+        with closing(self.connect()) as db:
+            rows = db.execute(
+                "SELECT d.id, d.hash, d.name, d.title, d.version, d.stored, "
+                f"(SELECT COUNT(*) FROM roles r WHERE r.document_id = d.id) AS roles FROM documents d {where} ORDER BY d.stored DESC",
+                params
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    @staticmethod
+    def filters(title=None, document=None, product=None, product_column=None):
+        """WHERE clause of the given filters only, a `:filter IS NULL OR` clause would keep SQLite
+        from searching the indexes"""
+        conditions, params = [], {}
+        if title is not None:
+            conditions.append("r.title LIKE :title ESCAPE '\\'")
+            params["title"] = like_prefix(title)
+        if document is not None:
+            conditions.append("d.title LIKE :document ESCAPE '\\'")
+            params["document"] = f"%{like_prefix(document)}"
+        if product is not None:
+            conditions.append(f"{product_column} = :product")
+            params["product"] = product
+        return ("WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+    def roles(self, title=None, document=None, product=None, limit=100):
+        """Roles with their metric buckets, pay curve and attainment modifiers, newest documents first.
+        `title` is the start of the role title and `document` part of the document title, both case insensitive,
+        `product` keeps the roles with an attainment modifier or an eligibility row for that product"""
+        where, params = self.filters(title, document)
+        if product is not None:
+            where = (f"{where} AND " if where else "WHERE ") + (
+                "(r.id IN (SELECT role_id FROM attainment_modifiers WHERE product = :product) "
+                "OR r.id IN (SELECT re.role_id FROM role_eligibility re JOIN eligibility_rows er ON er.table_id = re.table_id WHERE er.product = :product))"
+            )
+            params["product"] = product
+        with closing(self.connect()) as db:
+            roles = db.execute(
+                "SELECT r.id, r.title, r.gate_text, r.quota_cadence, r.unbalanced, r.other_information, r.degraded, "
+                "d.id AS document_id, d.title AS document, d.name AS file_name "
+                f"FROM roles r JOIN documents d ON d.id = r.document_id {where} "
+                "ORDER BY d.stored DESC, r.position LIMIT :limit",
+                {**params, "limit": limit}
+            ).fetchall()
+            results = []
+            for role in roles:
+                result = dict(role, degraded=bool(role["degraded"]))
+                for key, table, columns in (
+                    ("metric_buckets", "metric_buckets", "bucket, weightage"),
+                    ("pay_curve", "pay_curves", "attainment, payout"),
+                    ("attainment_modifiers", "attainment_modifiers", "product, modifier"),
+                ):
+                    result[key] = [list(row) for row in db.execute(f"SELECT {columns} FROM {table} WHERE role_id = ? ORDER BY position", (role["id"],))]
+                results.append(result)
+        return results
+
+    def products(self, product, document=None, limit=1000):
+        """Eligibility rows and attainment modifiers of `product` (exact, case insensitive) across
+        the stored documents, each with the roles it applies to"""
+        with closing(self.connect()) as db:
+            where, params = self.filters(document=document, product=product, product_column="er.product")
+            eligibility = db.execute(
+                "SELECT d.title AS document, d.name AS file_name, t.columns, er.cells, t.degraded, "
+                "(SELECT json_group_array(r.title) FROM role_eligibility re JOIN roles r ON r.id = re.role_id WHERE re.table_id = t.id) AS roles "
+                f"FROM eligibility_rows er JOIN eligibility_tables t ON t.id = er.table_id JOIN documents d ON d.id = t.document_id {where} "
+                "ORDER BY d.stored DESC, t.position, er.position LIMIT :limit",
+                {**params, "limit": limit}
+            ).fetchall()
+            where, params = self.filters(document=document, product=product, product_column="am.product")
+            modifiers = db.execute(
+                "SELECT d.title AS document, d.name AS file_name, r.title AS role, am.modifier "
+                f"FROM attainment_modifiers am JOIN roles r ON r.id = am.role_id JOIN documents d ON d.id = r.document_id {where} "
+                "ORDER BY d.stored DESC, r.position LIMIT :limit",
+                {**params, "limit": limit}
+            ).fetchall()
+        return {
+            "eligibility": [
+                {"document": row["document"], "file_name": row["file_name"], "roles": json.loads(row["roles"]),
+                 "row": dict(zip(json.loads(row["columns"]), json.loads(row["cells"]))), "degraded": bool(row["degraded"])}
+                for row in eligibility
+            ],
+            "attainment_modifiers": [dict(row) for row in modifiers]
+        }
+
+    def stats(self):
+        with closing(self.connect()) as db:
+            counts = {
+                table: db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("documents", "roles", "attainment_modifiers", "eligibility_rows")
+            }
+        return {**counts, "bytes": os.path.getsize(self.path)}
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Query the store of extracted compensation plans")
+    parser.add_argument("store", help="SQLite file written by the app (PLAN_STORE) or cli.py --store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    documents = commands.add_parser("documents", help="list the stored documents")
+    documents.add_argument("--title")
+    roles = commands.add_parser("roles", help="roles with their buckets, pay curve and modifiers")
+    roles.add_argument("--title", help="start of the role title")
+    roles.add_argument("--document", help="part of the document title, e.g. 2HFY25")
+    roles.add_argument("--product")
+    roles.add_argument("--limit", type=int, default=100)
+    products = commands.add_parser("products", help="eligibility rows and modifiers of a product")
+    products.add_argument("product")
+    products.add_argument("--document")
+    commands.add_parser("stats")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.store):
+        parser.error(f"no store at {args.store}")
+    store = PlanStore(args.store)
+    if args.command == "documents":
+        result = store.documents(args.title)
+    elif args.command == "roles":
+        result = store.roles(args.title, args.document, args.product, args.limit)
+    elif args.command == "products":
+        result = store.products(args.product, args.document)
+    else:
+        result = store.stats()
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,19 @@
+import copy
+import pytest
+from utils import WARM_UP_PDF, extract_comp_plan_content
+
+
+@pytest.fixture(scope="session")
+def extracted_plan():
+    return extract_comp_plan_content(WARM_UP_PDF)
+
+@pytest.fixture
+def comp_plan(extracted_plan):
+    """The parsed warm up plan, a copy each test can change"""
+    return copy.deepcopy(extracted_plan)
+
+@pytest.fixture
+def no_pay_curve_plan(comp_plan):
+    """The warm up plan with the pay curve of its first role missing, as parsed from a role page without one"""
+    next(info for info in comp_plan if "Title" in info)["Pay Curve"] = None
+    return comp_plan
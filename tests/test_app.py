@@ -0,0 +1,31 @@
+import os
+import time
+import pytest
+from utils import WARM_UP_PDF
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    """app.py imported in a folder of its own, extracting in the job threads"""
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(tmp_path_factory.mktemp("app"))
+        monkeypatch.setenv("EXTRACT_PROCESSES", "0")
+        import app
+        yield app
+
+def upload(app_module, file_name):
+    client = app_module.app.test_client()
+    with open(WARM_UP_PDF, "rb") as f:
+        response = client.post("/extract", data={"files": [(f, file_name)]}, content_type="multipart/form-data")
+    assert response.status_code == 202
+    job = app_module.job_queue.get(response.json["jobId"])
+    while job.status not in ("done", "failed"):
+        time.sleep(0.05)
+    return job, job.files[0]
+
+@pytest.mark.parametrize("file_name, saved_name", [("计划.pdf", "upload.pdf"), ("Plan.PDF", "Plan.pdf")])
+def test_upload_name_keeps_the_pdf(app_module, file_name, saved_name):
+    job, file = upload(app_module, file_name)
+    assert (file.status, file.name, file.output) == ("done", saved_name, os.path.splitext(saved_name)[0] + ".txt")
+    with open(os.path.join(job.folder, file.name), "rb") as f:
+        assert f.read(5) == b"%PDF-"
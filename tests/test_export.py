@@ -0,0 +1,21 @@
+import json
+import os
+import pandas as pd
+import pytest
+from utils import export_comp_plan, iter_comp_plan_sections
+
+
+def test_jsonl_role_without_pay_curve(tmp_path, no_pay_curve_plan):
+    [path] = export_comp_plan(no_pay_curve_plan, str(tmp_path / "plan"), ["jsonl"])
+    with open(path, encoding="utf-8") as f:
+        roles = [record for record in map(json.loads, f) if record["section"] == "role"]
+    assert roles[0]["pay_curve"] == []
+    assert all(role["pay_curve"] for role in roles[1:])
+
+def test_parquet_role_without_pay_curve(tmp_path, no_pay_curve_plan):
+    pytest.importorskip("pyarrow")
+    paths = export_comp_plan(no_pay_curve_plan, str(tmp_path / "plan"), ["parquet"])
+    assert [os.path.basename(path) for path in paths] == ["plan.eligibility.parquet", "plan.attainment_modifiers.parquet"]
+    modifiers = pd.read_parquet(paths[1])
+    roles = [section["title"] for section in iter_comp_plan_sections(no_pay_curve_plan) if section["section"] == "role"]
+    assert set(modifiers["role"]) <= set(roles)
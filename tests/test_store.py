@@ -0,0 +1,25 @@
+import shutil
+from jobs import FileProcessor, FileProgress
+from profiling import StageMetrics
+from store import PlanStore
+from utils import WARM_UP_PDF
+
+
+def test_put_role_without_pay_curve(tmp_path, no_pay_curve_plan):
+    store = PlanStore(str(tmp_path / "plans.sqlite3"))
+    store.put("hash", "plan.pdf", no_pay_curve_plan)
+    roles = store.roles()
+    assert roles[0]["pay_curve"] == []
+    assert all(role["pay_curve"] for role in roles[1:])
+
+class FailingStore:
+    def put_file(self, file, comp_plan, name=None):
+        raise OSError("disk full")
+
+def test_store_failure_does_not_fail_the_file(tmp_path):
+    file_path = shutil.copy(WARM_UP_PDF, tmp_path / "plan.pdf")
+    file, metrics = FileProgress("plan.pdf"), StageMetrics()
+    FileProcessor(store=FailingStore()).process(str(file_path), file, metrics)
+    assert file.output == "plan.txt"
+    assert (tmp_path / "plan.txt").stat().st_size > 0
+    assert metrics.store_failures == 1
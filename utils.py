@@ -1,18 +1,115 @@
 import pdfplumber
-from thefuzz import fuzz
-from thefuzz import process
+from pdfplumber.page import test_proposed_bbox
+from pdfplumber.table import Table
+from pdfplumber.utils import within_bbox
+from pdfminer.layout import LTChar, LTContainer
+from rapidfuzz import fuzz as rfuzz
+from rapidfuzz import process as rprocess
+from rapidfuzz.utils import default_process
 from pprint import pprint
 from dataclasses import dataclass, field
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import multiprocessing
+from multiprocessing.connection import wait as wait_connections
 import pandas as pd
 import numpy as np
+import json
 import re
+import gc
+import bisect
+from collections import Counter
+import os
+import time
+from constants import EXPORT_FORMATS, EXTRACTOR_VERSION
+from profiling import StageTimings, current_timings, profiled, stage, timed
 
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+@dataclass
+class PageAnchorIndex:
+    page: pdfplumber.page.Page
+    matches: dict = field(default_factory=dict, repr=False)
+
+    # each pattern is scanned once per page, bbox lookups filter the cached
+    # matches instead of cropping the page and re-scanning its chars
+
+    def search(self, pattern, bbox=None):
+        if pattern not in self.matches:
+            self.matches[pattern] = self.page.search(pattern)
+        matches = self.matches[pattern]
+        if bbox is None:
+            return matches
+        test_proposed_bbox(bbox, self.page.bbox)
+        return [match for match in matches if len(within_bbox(match["chars"], bbox)) == len(match["chars"])]
+
+@dataclass
+class PageTableIndex:
+    page: pdfplumber.page.Page
+    tables: list = field(default=None, repr=False)
+    extracted: dict = field(default_factory=dict, repr=False)
+
+    # the table finder runs once on the whole page, section parsers pick the detected
+    # tables lying inside their crop instead of re-running it on every crop
+
+    def detect(self):
+        if self.tables is None:
+            with stage("find_tables"):
+                self.tables = self.page.find_tables()
+        return self.tables
+
+    def extract(self, table_idx, cells):
+        key = (table_idx, tuple(cells))
+        if key not in self.extracted:
+            # Table.extract only reads the chars centred inside the table, handing it just those
+            # keeps it from rescanning every char on the page for each row
+            x0, top = min(cell[0] for cell in cells), min(cell[1] for cell in cells)
+            x1, bottom = max(cell[2] for cell in cells), max(cell[3] for cell in cells)
+            table_page = self.page.filter(lambda obj: obj["object_type"] == "char" and x0 <= (obj["x0"] + obj["x1"]) / 2 < x1 and top <= (obj["top"] + obj["bottom"]) / 2 < bottom)
+            self.extracted[key] = Table(table_page, cells).extract()
+        return self.extracted[key]
+
+    def tables_within(self, bbox):
+        """(table index, cells) of the detected tables with cells inside `bbox`. A table crossing the
+        edge of the crop keeps the cells inside it, as the table finder run on the crop would: the
+        cells cut by the edge are not closed there"""
+        test_proposed_bbox(bbox, self.page.bbox)
+        x0, top, x1, bottom = bbox
+        within = []
+        for table_idx, table in enumerate(self.detect()):
+            if cells := [cell for cell in table.cells if cell[0] >= x0 and cell[1] >= top and cell[2] <= x1 and cell[3] <= bottom]:
+                within.append((table_idx, cells))
+        return within
+
+    def extract_tables(self, bbox):
+        return [self.extract(table_idx, cells) for table_idx, cells in self.tables_within(bbox)]
+
+    def extract_table(self, bbox):
+        # same pick as Page.find_table: the largest table by number of cells
+        within = sorted(self.tables_within(bbox), key=lambda item: (-len(item[1]), min(cell[1] for cell in item[1]), min(cell[0] for cell in item[1])))
+        return self.extract(*within[0]) if within else None
 
 @dataclass
 class CompPlanScraper:
     page: pdfplumber.page.Page
     height: float
     width: float
+    anchors: PageAnchorIndex = None
+    tables: PageTableIndex = None # shared table detection, when not set every crop runs its own
+
+    def __post_init__(self):
+        if self.anchors is None:
+            self.anchors = PageAnchorIndex(self.page)
 
     #################################
     # bbox_rules = (x0, y0, x1, y1) #
@@ -42,11 +139,23 @@ class CompPlanScraper:
         text = self.page.within_bbox(bbox_rules).extract_text()
         return text
 
+    def parse_tables_within_bbox(self, bbox_rules):
+        if self.tables is None:
+            return self.page.within_bbox(bbox_rules).extract_tables()
+        return self.tables.extract_tables(bbox_rules)
+
+    def parse_table_within_bbox(self, bbox_rules):
+        if self.tables is None:
+            return self.page.within_bbox(bbox_rules).extract_table()
+        return self.tables.extract_table(bbox_rules)
+
+    @timed
     def parse_doc_title(self):
         title_bbox = (0, 20, self.page.width, 120) 
         title = self.parse_text_within_bbox(title_bbox)
         return title
 
+    @timed
     def parse_comp_plan_roles(self):
         cord_roles, cols = self.parse_col_coordinates()
 
@@ -60,9 +169,9 @@ class CompPlanScraper:
 
         roles_with_titles = {}
         current_title = ""
-        for role in roles:
-            matches = process.extract(role, cord_roles, scorer=fuzz.ratio)
-            if matches[0][1] > 90:
+        scores = FuzzyMatcher(cord_roles).best_scores(roles, score_cutoff=90)
+        for role, score in zip(roles, scores):
+            if score > 90:
                 if current_title == role:
                     roles_with_titles[current_title].append(role)
                 else:
@@ -75,11 +184,12 @@ class CompPlanScraper:
 @dataclass
 class CompPlanDetails(CompPlanScraper): 
             
+    @timed
     def parse_details_title(self, merged_page=False):
         if not merged_page:
             metric_bucket_info = 70
         else:
-            metric_bucket_info = self.page.search("Metric Bucket")[0]["top"]
+            metric_bucket_info = self.anchors.search("Metric Bucket")[0]["top"]
         title_bbox = (0, metric_bucket_info - 50, self.page.width / 2, metric_bucket_info + 10)  
         title = self.parse_text_within_bbox(title_bbox)
         try:
@@ -88,51 +198,59 @@ class CompPlanDetails(CompPlanScraper):
             title_type = "None"
         return (title, title_type)
 
+    @timed
     def parse_attainment_modifiers(self):
-        attainment_modifiers_table_details = [(content["top"], content["x0"]) for content in self.page.search("Attainment Modifiers")][-1] # (top, x0)
-        attainment_modifiers = self.page.within_bbox((attainment_modifiers_table_details[1]-30, attainment_modifiers_table_details[0], self.width - 100, self.height)).extract_tables()
+        attainment_modifiers_table_details = [(content["top"], content["x0"]) for content in self.anchors.search("Attainment Modifiers")][-1] # (top, x0)
+        attainment_modifiers = self.parse_tables_within_bbox((attainment_modifiers_table_details[1]-30, attainment_modifiers_table_details[0], self.width - 100, self.height))
         attainment_modifiers_all = []
         for attainment_modifier in attainment_modifiers:
             attainment_modifiers_all.extend(attainment_modifier)
         return attainment_modifiers_all
     
+    @timed
     def parse_remaining_attainment_modifiers(self):
-        attainment_modifiers = self.page.within_bbox((0, 20, self.width, self.height)).extract_table()  
+        attainment_modifiers = self.parse_table_within_bbox((0, 20, self.width, self.height))  
         return attainment_modifiers
 
+    @timed
     def parse_metric_bucket(self):
-        metric_title = [(content["top"], content["x0"]) for content in self.page.search("Metric Bucket")][0]
+        metric_title = [(content["top"], content["x0"]) for content in self.anchors.search("Metric Bucket")][0]
         try:
-            attainment_modifiers_title = [(content["top"], content["x0"]) for content in self.page.search("Attainment Modifiers")][0]
+            attainment_modifiers_title = [(content["top"], content["x0"]) for content in self.anchors.search("Attainment Modifiers")][0]
         except IndexError:
             attainment_modifiers_title = [self.height]
-        paycurve_title = [(content["top"], content["x0"]) for content in self.page.search("PayCurve")][0]
-        contents = self.page.within_bbox((metric_title[1], metric_title[0], paycurve_title[1], attainment_modifiers_title[0])).extract_tables()
+        paycurve_title = [(content["top"], content["x0"]) for content in self.anchors.search("PayCurve")][0]
+        contents = self.parse_tables_within_bbox((metric_title[1], metric_title[0], paycurve_title[1], attainment_modifiers_title[0]))
         return contents
 
+    @timed
     def parse_paycurve(self):
-        paycurve_table_details = [(content["top"], content["x0"]) for content in self.page.search("PayCurve")][-1] # (top, x0)
-        paycurve = self.page.within_bbox((paycurve_table_details[1]-80, paycurve_table_details[0], paycurve_table_details[1] + 150, paycurve_table_details[0]+120)).extract_table()
+        paycurve_table_details = [(content["top"], content["x0"]) for content in self.anchors.search("PayCurve")][-1] # (top, x0)
+        paycurve = self.parse_table_within_bbox((paycurve_table_details[1]-80, paycurve_table_details[0], paycurve_table_details[1] + 150, paycurve_table_details[0]+120))
         return paycurve
 
+    @timed
     def parse_gate_text(self):
-        gate_text_table_details = [(content["top"], content["x0"]) for content in self.page.search("Gate Text")][-1] # (top, x0)
+        gate_text_table_details = [(content["top"], content["x0"]) for content in self.anchors.search("Gate Text")][-1] # (top, x0)
         gate_text = self.page.within_bbox((gate_text_table_details[1]-80, gate_text_table_details[0], gate_text_table_details[1] + 150, gate_text_table_details[0]+100)).extract_text()
         return " ".join([content for content in gate_text.split("\n") if content != "" ])
 
+    @timed
     def parse_quota_cadence(self):
-        quota_cadence_table_details = [(content["top"], content["x0"]) for content in self.page.search("Quota Cadence")][-1] # (top, x0)
+        quota_cadence_table_details = [(content["top"], content["x0"]) for content in self.anchors.search("Quota Cadence")][-1] # (top, x0)
         quota_cadence = self.page.within_bbox((quota_cadence_table_details[1]-80, quota_cadence_table_details[0], quota_cadence_table_details[1] + 150, quota_cadence_table_details[0]+100)).extract_text()
         return " ".join([content for content in quota_cadence.split("\n") if content != "" ]).replace("Quota Cadence ", "")
 
+    @timed
     def parse_unbalanced(self):
-        unbalanced_table_details = [(content["top"], content["x0"]) for content in self.page.search("Unbalanced")][0] # (top, x0)
+        unbalanced_table_details = [(content["top"], content["x0"]) for content in self.anchors.search("Unbalanced")][0] # (top, x0)
         unbalanced = self.page.within_bbox((unbalanced_table_details[1]-80, unbalanced_table_details[0], self.width, unbalanced_table_details[0]+200)).extract_text()
         return " ".join([content for content in unbalanced.split("\n") if content != "" ]).replace("Unbalanced ", "").replace("Other Information", "")
 
+    @timed
     def parse_other_information(self):
-        metric_bucket_info = self.page.search("Metric Bucket")[0]["top"]
-        other_information_table_details = [(content["top"], content["x0"]) for content in self.page.within_bbox((0, metric_bucket_info, self.width, self.height)).search("Other Information")][0] # (top, x0)
+        metric_bucket_info = self.anchors.search("Metric Bucket")[0]["top"]
+        other_information_table_details = [(content["top"], content["x0"]) for content in self.anchors.search("Other Information", (0, metric_bucket_info, self.width, self.height))][0] # (top, x0)
         try:
             other_information = self.page.within_bbox((other_information_table_details[1]-50, other_information_table_details[0], self.width, other_information_table_details[0]+300)).extract_text() 
         except ValueError:
@@ -149,13 +267,18 @@ class CompPlanDetails(CompPlanScraper):
         return remaining_text_x0s
 
     def parse_product_eligibility(self, last_page=False):
-        product_eligibility_table_details = [(content["top"], content["x0"]) for content in self.page.search("Product Eligibility")][-1] # (top, x0)
-        table_start_xs = [l1["x0"] for l1 in self.page.search("L1 Type")]  
+        pe_dfs, all_cols_infos = self.parse_product_eligibility_tables()
+        return pe_dfs if not last_page else all_cols_infos
+
+    @timed
+    def parse_product_eligibility_tables(self):
+        product_eligibility_table_details = [(content["top"], content["x0"]) for content in self.anchors.search("Product Eligibility")][-1] # (top, x0)
+        table_start_xs = [l1["x0"] for l1 in self.anchors.search("L1 Type")]  
         potential_boundaries = ["Other Information", "error has occurred"]
         boundary = None
         for potential_boundary in potential_boundaries:
             try:
-                boundary = self.page.search(potential_boundary)[0]["x0"]
+                boundary = self.anchors.search(potential_boundary)[0]["x0"]
                 break
             except IndexError:
                 pass
@@ -166,10 +289,10 @@ class CompPlanDetails(CompPlanScraper):
         pe_dfs = []
         for idx in range(len(table_start_xs)-1):
             x0, x1 = table_start_xs[idx], table_start_xs[idx+1]
-            top_boundary = self.page.search("Click on Metric names")[0]["top"]
+            top_boundary = self.anchors.search("Click on Metric names")[0]["top"]
             left_shift = 100
             top_shift = 100
-            product_eligibility = self.page.within_bbox((0 if idx == 0 else x0 - left_shift, top_boundary, x1, self.page.bbox[3])).extract_table()
+            product_eligibility = self.parse_table_within_bbox((0 if idx == 0 else x0 - left_shift, top_boundary, x1, self.page.bbox[3]))
             pe_df = pd.DataFrame(product_eligibility)
             pe_df.columns = pe_df.iloc[0, :].ffill()
             # print(pe_df)
@@ -180,7 +303,7 @@ class CompPlanDetails(CompPlanScraper):
                 col_infos = []
                 for row in row_infos:
                     try:
-                        col_info = self.page.within_bbox((0 if idx == 0 else x0 - left_shift, product_eligibility_table_details[0] - 10, x1, self.page.bbox[3] - 30)).search(row.split("\n")[0])
+                        col_info = self.anchors.search(row.split("\n")[0], (0 if idx == 0 else x0 - left_shift, product_eligibility_table_details[0] - 10, x1, self.page.bbox[3] - 30))
                         col_infos.append(col_info[0]["x0"])
                     except IndexError:
                         pass
@@ -190,7 +313,7 @@ class CompPlanDetails(CompPlanScraper):
                     # print(last_row_infos)
                     for last_row_info in last_row_infos:
                         try:
-                            last_row_top = [info["top"] for info in self.page.within_bbox((0 if idx == 0 else x0 - left_shift, product_eligibility_table_details[0], x1, self.page.bbox[3] - 30)).search(last_row_info)]
+                            last_row_top = [info["top"] for info in self.anchors.search(last_row_info, (0 if idx == 0 else x0 - left_shift, product_eligibility_table_details[0], x1, self.page.bbox[3] - 30))]
                             break
                         except Exception as e:
                             # print(e)
@@ -205,24 +328,23 @@ class CompPlanDetails(CompPlanScraper):
                             remaining_table = categorize_col_infos(remaining_text_x0s, col_infos)
                             cols = pe_df.columns.tolist()
                             if len(remaining_table) == len(cols):
-                                pe_df.columns = range(len(cols))
                                 if sum([bool(item) for item in remaining_table]) > 0:
-                                    remaining_rows_info = pd.DataFrame(remaining_table, index=pe_df.columns).replace("", np.nan).T
-                                    pe_df = pd.concat([pe_df, remaining_rows_info], axis=0).reset_index(drop=True)
+                                    pe_df = EligibilityTable(pe_df, [remaining_table]).to_frame()
                                 pe_df.columns = cols
             except IndexError:
                 pass
             # print(pe_df)
             # print("==========")
             pe_dfs.append(pe_df)
-        return pe_dfs if not last_page else all_cols_infos
+        return pe_dfs, all_cols_infos
 
+    @timed
     def parse_next_page_product_eligibility(self):
         text_cols = self.get_remaining_text_x0s(self.page.within_bbox((0, 30, self.page.width, self.page.bbox[3])).extract_text_lines())
         return text_cols
     
     def check_if_title_is_empty(self, title) -> bool:
-        return len(self.page.search(title)) == 0
+        return len(self.anchors.search(title)) == 0
     
 def return_none_if_empty(func):
     try:
@@ -236,22 +358,81 @@ def output_to_txt(roles, infos):
         for info in infos:
             f.write(rf"Information: {info}\n")
 
+@dataclass
+class FuzzyMatcher:
+    """Best fuzz.ratio score of each query against a fixed list of choices, scoring all the
+    queries in one batch. Scores are rounded like thefuzz and by default both sides go through
+    the same processing as process.extract"""
+    choices: list[str]
+    processor: callable = default_process
+
+    def __post_init__(self):
+        self.processed_choices = [self.process(choice) for choice in self.choices]
+        self.exact_choices = set(self.processed_choices)
+
+    def process(self, text):
+        return self.processor(text) if self.processor else text
+
+    def best_scores(self, queries, score_cutoff=0):
+        """scores under `score_cutoff` come back as 0"""
+        queries = [self.process(query) for query in queries]
+        if queries and not self.choices:
+            raise IndexError("no choices to match against")
+        scores = [100 if query in self.exact_choices else None for query in queries]
+        pending = [idx for idx, score in enumerate(scores) if score is None]
+        if pending:
+            matrix = rprocess.cdist([queries[idx] for idx in pending], self.processed_choices, scorer=rfuzz.ratio, score_cutoff=score_cutoff, dtype=np.float64)
+            for idx, best in zip(pending, matrix.max(axis=1)):
+                scores[idx] = int(round(best))
+        return scores
+
+    def best_score(self, query, score_cutoff=0):
+        return self.best_scores([query], score_cutoff)[0]
+
 def text_comparison(text1, text2):
-    return fuzz.ratio(text1, text2)
+    return FuzzyMatcher([text2], processor=None).best_score(text1)
 
 def categorize_col_infos(col_infos: list[tuple], benchmark_infos: list):
-    targeted_cols = [''] * len(benchmark_infos)
-    benchmark_infos = sorted(list(set(benchmark_infos)))
-    for col_info in col_infos:
-        num_col  = 0
-        # print(benchmark_infos)
-        for benchmark_info in benchmark_infos:
-            if col_info[0] >= benchmark_info:
-                num_col += 1
+    targeted_cols = [[] for _ in benchmark_infos]
+    benchmark_infos = np.unique(benchmark_infos)
+    # column of each text = number of benchmark x0s at or left of it, found by binary search
+    num_cols = np.searchsorted(benchmark_infos, [col_info[0] for col_info in col_infos], side="right")
+    for num_col, col_info in zip(num_cols, col_infos):
         if num_col > 0:
-            # print("num of col:",num_col - 1)
-            targeted_cols[num_col - 1] += col_info[1] + "\n"
-    return [col.strip() for col in targeted_cols]
+            targeted_cols[num_col - 1].append(col_info[1])
+    return ["\n".join(col).strip() for col in targeted_cols]
+
+class EligibilityTable:
+    """Product eligibility DataFrame with rows appended from continuation pages. The rows are
+    buffered and the table is materialized once, instead of a concat per appended row"""
+
+    def __init__(self, df, rows=None):
+        self.df = df
+        self.rows = rows or []
+
+    def append(self, row):
+        if len(row) != len(self.df.columns):
+            raise ValueError(f"Length of values ({len(row)}) does not match length of index ({len(self.df.columns)})")
+        self.rows.append(row)
+
+    def to_frame(self):
+        if not self.rows:
+            return self.df
+        cols = self.df.columns.tolist()
+        remaining_df = pd.DataFrame(self.rows, columns=range(len(cols))).replace("", np.nan)
+        pe_df = pd.concat([self.df.set_axis(range(len(cols)), axis=1), remaining_df], axis=0).reset_index(drop=True)
+        pe_df.columns = cols
+        return pe_df
+
+@timed
+def build_eligibility_tables(infos):
+    """Materializes the EligibilityTables merge_page_content left in `infos`"""
+    for info in infos:
+        if pe_dfs := info.get("product_eligibility"):
+            for table_idx, pe_df in enumerate(pe_dfs):
+                if isinstance(pe_df, EligibilityTable):
+                    pe_dfs[table_idx] = pe_df.to_frame()
+    return infos
 
 def parse_content_details(title, comp_plan_details):
     attainment_modifiers = return_none_if_empty(comp_plan_details.parse_attainment_modifiers)
@@ -273,83 +454,621 @@ def parse_content_details(title, comp_plan_details):
     }
     return info
 
-def extract_comp_plan_content(file):
+@dataclass
+class PageScan:
+    """Class of a page from a minimal char scan, one of cover, details, merged_details_eligibility,
+    eligibility, eligibility_continuation, attainment_modifier_spillover or empty. The class only
+    mirrors the branches of parse_page_content, which stays the authority on the page content"""
+    page_class: str
+    touches_title: bool = True
+    has_product_eligibility: bool = True
+    text: str = field(default=None, repr=False) # page text in content stream order, whitespace removed
+
+    def is_skippable(self):
+        # no text near the title, so parse_page_content would find the page empty, and no
+        # "Product Eligibility" text for the column anchors probe to find either
+        return not self.touches_title and not self.has_product_eligibility
+
+def iter_layout_chars(layout_objs):
+    for obj in layout_objs:
+        if isinstance(obj, LTChar):
+            yield obj
+        elif isinstance(obj, LTContainer):
+            yield from iter_layout_chars(obj)
+
+@timed
+def scan_page(page, index):
+    """Classifies a page straight from its pdfminer layout, without the char dicts, crops and text
+    maps of the section parsers. page.layout is cached, so parsing the page afterwards reuses it"""
+    if index == 0:
+        return PageScan("cover")
+    # same crop as CompPlanDetails.parse_details_title on a page that is not merged
+    title_x0, title_top, title_x1, title_bottom = 0, 20, page.width / 2, 80
+    mb_x0, mb_top = page.mediabox[:2]
+    title_chars, texts, touches_title = [], [], False
+    for char in iter_layout_chars(page.layout):
+        text = char.get_text()
+        texts.append(text)
+        # page coordinates the way pdfplumber derives them for its char dicts
+        x0, x1 = char.x0 + mb_x0, char.x1 + mb_x0
+        top, bottom = page.height - char.y1 + mb_top, page.height - char.y0 + mb_top
+        if x0 <= title_x1 and x1 >= title_x0 and top <= title_bottom and bottom >= title_top:
+            touches_title = True
+            if x0 >= title_x0 and x1 <= title_x1 and top >= title_top and bottom <= title_bottom:
+                title_chars.append((round(top), x0, text, str(char.fontname)))
+    page_text = re.sub(r"\s", "", "".join(texts))
+    # word by word, the text map behind page.search may order the words differently than the content stream
+    has_product_eligibility = "Product" in page_text and "Eligibility" in page_text
+    if not title_chars:
+        page_class = "empty"
+    else:
+        title_chars.sort()
+        title = re.sub(r"\s", "", "".join(char[2] for char in title_chars))
+        if "bold" not in title_chars[0][3].lower():
+            page_class = "eligibility_continuation"
+        elif title == "ProductEligibility":
+            page_class = "merged_details_eligibility" if "MetricBucket" in page_text else "eligibility"
+        else:
+            page_class = "details" if "MetricBucket" in page_text else "attainment_modifier_spillover"
+    return PageScan(page_class, touches_title, has_product_eligibility, page_text)
+
+# fixed headings the section parsers look up, their matches make up a page's layout profile
+LAYOUT_ANCHORS = (
+    "Metric Bucket", "PayCurve", "Gate Text", "Quota Cadence", "Unbalanced", "Other Information",
+    "Attainment Modifiers", "Product Eligibility", "L1 Type", "Click on Metric names", "error has occurred"
+)
+LAYOUT_PAGE_CLASSES = ("details", "merged_details_eligibility", "eligibility", "attainment_modifier_spillover")
+
+def build_layout_profile(anchors):
+    """The layout anchors `anchors` discovered on its page, reduced to what the parsers read from
+    a match: its position and the boxes of its chars"""
+    return {
+        pattern: [
+            {
+                "text": match["text"],
+                "x0": match["x0"], "top": match["top"], "x1": match["x1"], "bottom": match["bottom"],
+                "chars": [{"x0": char["x0"], "top": char["top"], "x1": char["x1"], "bottom": char["bottom"]} for char in match["chars"]]
+            }
+            for match in anchors.matches[pattern]
+        ]
+        for pattern in LAYOUT_ANCHORS if pattern in anchors.matches
+    }
+
+def anchors_in_place(chars, tops, profile):
+    """Whether the chars of `chars` (sorted by top, with `tops` their tops) spell every anchor of
+    `profile` inside the box the profile recorded for it"""
+    for matches in profile.values():
+        for match in matches:
+            candidates = chars[bisect.bisect_left(tops, match["top"]):bisect.bisect_right(tops, match["bottom"])]
+            inside = "".join(char["text"] for char in candidates if char["x0"] >= match["x0"] and char["x1"] <= match["x1"] and char["bottom"] <= match["bottom"])
+            if re.sub(r"\s", "", inside) != re.sub(r"\s", "", match["text"]):
+                return False
+    return True
+
+@timed
+def match_layout_profile(page, scan, profiles):
+    """First of `profiles` whose anchors all sit on `page` exactly where the profile has them, with
+    no other occurrence of them in the page text, or None"""
+    chars = tops = None
+    for profile in profiles:
+        if any(scan.text.count(re.sub(r"\s", "", pattern)) != len(matches) for pattern, matches in profile.items()):
+            continue
+        if chars is None:
+            chars = sorted(page.chars, key=lambda char: char["top"])
+            tops = [char["top"] for char in chars]
+        if anchors_in_place(chars, tops, profile):
+            return profile
+    return None
+
+def parse_page_content(page, index, anchors=None, tables=None):
+    """Parses a single page into a partial result that merge_page_content folds into `infos`"""
+    page_scraper = CompPlanScraper(page, page.height, page.width, anchors, tables)
+    if index == 0:
+        roles = page_scraper.parse_comp_plan_roles()
+        return {
+            "type": "cover",
+            "info": {
+                "Document Title":  page_scraper.parse_doc_title(),
+                "Roles Availability": roles
+            }
+        }
+    comp_plan_details = CompPlanDetails(page, page.height, page.width, page_scraper.anchors, page_scraper.tables)
+    title, title_type = comp_plan_details.parse_details_title()
+    if title != "Product Eligibility" and "bold" in title_type.lower():
+        if comp_plan_details.check_if_title_is_empty("Metric Bucket"):
+            return {
+                "type": "remaining_attainment_modifiers",
+                "attainment_modifiers": return_none_if_empty(comp_plan_details.parse_remaining_attainment_modifiers)
+            }
+        return {"type": "details", "info": parse_content_details(title, comp_plan_details)}
+
+    elif title == "Product Eligibility" and "bold" in title_type.lower():
+        try:
+            product_eligibility, column_anchors = comp_plan_details.parse_product_eligibility_tables()
+        except IndexError:
+            product_eligibility, column_anchors = None, None
+        content = {
+            "type": "product_eligibility",
+            "product_eligibility": product_eligibility,
+            "column_anchors": column_anchors
+        }
+        if not comp_plan_details.check_if_title_is_empty("Metric Bucket"):
+            merged_page_new_title = comp_plan_details.parse_details_title(merged_page=True)[0]
+            content["info"] = parse_content_details(merged_page_new_title, comp_plan_details)
+        return content
+
+    ## if the page do not have any title or simply do not have anything
+    if title_type == "None":
+        return {"type": "empty"}
+    return {
+        "type": "continuation",
+        "remaining_table": comp_plan_details.parse_next_page_product_eligibility()
+    }
+
+@timed
+def parse_text_details(title, comp_plan_details):
+    """parse_content_details without the table sections, which come back empty"""
+    return {
+        "Title": title,
+        "Metric Bucket Weightage": [],
+        "Pay Curve": [],
+        "Gate Text": return_none_if_empty(comp_plan_details.parse_gate_text),
+        "Quota Cadence": return_none_if_empty(comp_plan_details.parse_quota_cadence),
+        "Unbalanced": return_none_if_empty(comp_plan_details.parse_unbalanced),
+        "Attainment Modifiers": [],
+        "Other Information": return_none_if_empty(comp_plan_details.parse_other_information),
+        "Degraded": True
+    }
+
+def parse_degraded_page_content(page, index, scan):
+    """Text-only fallback of parse_page_content for a page that went over its time budget. The page
+    is routed by its PageScan class and never goes through the table finder: table sections are
+    left empty and product eligibility tables become a single column of the page's text lines"""
+    if index == 0:
+        return parse_page_content(page, index)
+    comp_plan_details = CompPlanDetails(page, page.height, page.width)
+    if scan.page_class == "details":
+        return {"type": "details", "info": parse_text_details(comp_plan_details.parse_details_title()[0], comp_plan_details)}
+    if scan.page_class in ("eligibility", "merged_details_eligibility"):
+        lines = pd.DataFrame([[line["text"]] for line in page.extract_text_lines()], columns=["Text"])
+        # no column anchors, the continuation pages of this table are not stitched onto it
+        content = {"type": "product_eligibility", "product_eligibility": [lines], "column_anchors": [], "degraded": True}
+        if scan.page_class == "merged_details_eligibility":
+            content["info"] = parse_text_details(comp_plan_details.parse_details_title(merged_page=True)[0], comp_plan_details)
+        return content
+    if scan.page_class == "eligibility_continuation":
+        return {"type": "continuation", "remaining_table": comp_plan_details.parse_next_page_product_eligibility()}
+    # a spillover table is left out rather than overwriting the modifiers of the page before
+    return {"type": "empty"}
+
+def merge_page_content(infos, index, content, column_anchors):
+    """Folds one page's partial result into `infos`, `column_anchors(index)` returns the
+    product eligibility column anchors of a previous page or raises IndexError"""
+    if content["type"] in ("cover", "details"):
+        infos.append(content["info"])
+
+    elif content["type"] == "remaining_attainment_modifiers":
+        last_info = infos[-1]
+        last_info["Attainment Modifiers"] = content["attainment_modifiers"]
+        infos[-1] = last_info
+
+    elif content["type"] == "product_eligibility":
+        infos.append({
+            "product_eligibility": content["product_eligibility"],
+            **({"Degraded": True} if content.get("degraded") else {})
+        })
+        if "info" in content:
+            infos.append(content["info"])
+
+    elif content["type"] == "continuation":
+        num_page_to_last_table = 1
+        while True:
+            try:
+                last_page_tables = column_anchors(index - num_page_to_last_table)
+                break
+            except IndexError:
+                num_page_to_last_table += 1
+        remaining_table = content["remaining_table"]
+        tables = {}
+        for last_page_table_idx, last_page_table in enumerate(last_page_tables):
+            table = categorize_col_infos(remaining_table, last_page_table)
+            if sum([bool(item) for item in table]) > 0:
+                tables[last_page_table_idx] = table
+        pe_dfs = infos[-1]["product_eligibility"]
+        for table_idx in tables:
+            # rows are buffered across continuation pages, build_eligibility_tables turns them into DataFrames
+            if not isinstance(pe_dfs[table_idx], EligibilityTable):
+                pe_dfs[table_idx] = EligibilityTable(pe_dfs[table_idx])
+            pe_dfs[table_idx].append(tables[table_idx])
+        infos[-1]["product_eligibility"] = pe_dfs
+    return infos
+
+def extract_comp_plan_content(file, workers=None, progress=None, page_cache=None, shared_tables=False, streaming=False, memory_limit=None, report=None, profile=None, layouts=None, page_budget=None, document_budget=None):
+    """`streaming` releases every page's layout cache once the page is parsed and keeps the
+    growth of the process RSS over its level when the document started under `memory_limit`
+    bytes, see MemoryMonitor. The sampled peak RSS is written to `report`,
+    along with the wall time and call count of every stage for the document and for each page.
+    `profile` is a path the cProfile stats of this document are dumped to. `layouts` is a store
+    of layout profiles (cache.LayoutProfiles) to match pages against, the layouts discovered on
+    the other pages are handed to it once the document is extracted. Pages going over
+    `page_budget` seconds, or left when the document passes `document_budget` seconds, are parsed
+    by the text-only fallback and listed as degraded in `report`"""
+    monitor = MemoryMonitor(memory_limit)
+    timings = StageTimings()
+    profiles = layouts.snapshot() if layouts is not None else None
+    with timings.activate(), profiled(profile), timings.stage("document"):
+        if (workers and workers > 1) or page_cache is not None or page_budget or document_budget:
+            results = collect_page_results(file, workers, progress, page_cache, shared_tables, streaming, monitor, profiles, page_budget, document_budget)
+            infos = merge_page_results(results)
+        else:
+            results = []
+            infos = extract_pages(file, progress, shared_tables, streaming, monitor, profiles, results)
+    if layouts is not None:
+        layouts.learn(learned_layouts(results))
+    monitor.write_report(report)
+    timings.write_report(report)
+    write_page_report(report, results)
+    return infos
+
+def learned_layouts(results):
+    """First layout discovered for each page class"""
+    learned = {}
+    for result in results:
+        if result.layout is not None and result.page_class not in learned:
+            learned[result.page_class] = result.layout
+    return learned
+
+def write_page_report(report, results):
+    """Counts of each PageScan class, the number of pages cropped from a layout profile, the pages
+    parsed by the text-only fallback, and the class of every page next to its timings"""
+    if report is None:
+        return
+    # pages served from a page cache written before the pre-pass existed have no class
+    page_classes = [result.page_class for result in results]
+    report["page_classes"] = dict(Counter(page_class for page_class in page_classes if page_class is not None))
+    report["layout_profile_pages"] = sum(result.profiled for result in results)
+    report["degraded_pages"] = [index for index, result in enumerate(results) if result.degraded]
+    for page in report.get("pages", []):
+        if page["page"] < len(page_classes) and page_classes[page["page"]] is not None:
+            page["class"] = page_classes[page["page"]]
+
+def extract_pages(file, progress=None, shared_tables=False, streaming=False, monitor=None, profiles=None, results=None):
+    """Parses and merges the pages one after the other in this process, the PageResult of every
+    page is appended to `results`"""
+    monitor = monitor or MemoryMonitor()
     infos = []
-    roles = None
     with pdfplumber.open(file) as pdf:
         pages = pdf.pages
-        for index, page in list(enumerate(pages))[:]:
-            # print(index + 1)
+        # PageResult of the last page with product eligibility column anchors, continuation
+        # pages stitch onto it instead of walking back and re-parsing the previous pages
+        carried = None
+
+        def column_anchors(page_index):
+            if carried is not None:
+                return carried.get_column_anchors()
+            last_page = pages[page_index]
+            tables = PageTableIndex(last_page) if shared_tables else None
+            return CompPlanDetails(last_page, last_page.height, last_page.width, tables=tables).parse_product_eligibility(last_page=True)
+
+        for index, page in enumerate(pages):
             # print("Extracting Info from page {}".format(index))
-            page_scraper = CompPlanScraper(page, page.height, page.width)
-            if index == 0:
-                roles = page_scraper.parse_comp_plan_roles()
-                infos.append({
-                        "Document Title":  page_scraper.parse_doc_title(),
-                        "Roles Availability": roles
-                    })
+            result = parse_page_result(page, index, shared_tables, profiles)
+            merge_page_content(infos, index, result.get_content(), column_anchors)
+            if not isinstance(result.column_anchors_error, IndexError):
+                carried = result
+            if results is not None:
+                results.append(result)
+            monitor.sample()
+            if streaming:
+                page.close()
+                monitor.enforce(pdf)
+            if progress:
+                progress(index + 1, len(pages))
+    return build_eligibility_tables(infos)
+
+@dataclass
+class PageResult:
+    content: dict = None
+    content_error: Exception = None
+    column_anchors: list = None
+    column_anchors_error: Exception = None
+    page_class: str = None # PageScan class of the page
+    layout: dict = None # layout profile discovered on the page, handed back for LayoutProfiles to learn
+    profiled: bool = False # anchors came from a matching layout profile
+    degraded: bool = False # parsed by the text-only fallback after going over its time budget
+    timings: dict = None # stages of a page parsed in a worker process, handed back to the parent
+
+    def get_content(self):
+        if self.content_error is not None:
+            raise self.content_error
+        return self.content
+
+    def get_column_anchors(self):
+        if self.column_anchors_error is not None:
+            raise self.column_anchors_error
+        return self.column_anchors
+
+    def is_reusable(self):
+        # a page without product eligibility tables is a normal outcome, any other error is not kept
+        return not self.degraded and self.content_error is None and (self.column_anchors_error is None or isinstance(self.column_anchors_error, IndexError))
+
+def parse_page_result(page, index, shared_tables=False, profiles=None):
+    """Parses a page together with its product eligibility column anchors, both depend on this page only.
+    With `shared_tables` the page's tables are detected once and handed out to the section parsers.
+    `profiles` maps page classes to known layout profiles: a page matching one skips the anchor
+    search, any other page of those classes hands back the layout it discovered"""
+    timings = current_timings()
+    with timings.page(index) if timings is not None else nullcontext():
+        result = PageResult()
+        scan = scan_page(page, index)
+        result.page_class = scan.page_class
+        if scan.is_skippable():
+            result.content = {"type": "empty"}
+            result.column_anchors_error = IndexError("no product eligibility tables on page {}".format(index))
+            return result
+        anchors = PageAnchorIndex(page)
+        learn = profiles is not None and scan.page_class in LAYOUT_PAGE_CLASSES
+        if learn and (profile := match_layout_profile(page, scan, profiles.get(scan.page_class, []))) is not None:
+            anchors.matches.update(profile)
+            result.profiled, learn = True, False
+        tables = PageTableIndex(page) if shared_tables else None
+        try:
+            result.content = parse_page_content(page, index, anchors, tables)
+        except Exception as e:
+            result.content_error = e
+        try:
+            if result.content is not None and result.content["type"] == "product_eligibility":
+                if (column_anchors := result.content["column_anchors"]) is None:
+                    raise IndexError("no product eligibility tables on page {}".format(index))
+                result.column_anchors = column_anchors
+            elif not scan.has_product_eligibility:
+                raise IndexError("no product eligibility tables on page {}".format(index))
             else:
-                comp_plan_details = CompPlanDetails(page, page.height, page.width)
-                title, title_type = comp_plan_details.parse_details_title()
-                # print(title)
-                if title != "Product Eligibility" and "bold" in title_type.lower():
-                    if comp_plan_details.check_if_title_is_empty("Metric Bucket"):
-                        last_info = infos[-1]
-                        last_info["Attainment Modifiers"] = return_none_if_empty(comp_plan_details.parse_remaining_attainment_modifiers)
-                        infos[-1] = last_info
-                    else:
-                        info = parse_content_details(title, comp_plan_details)
-                        infos.append(info)
-
-                elif title == "Product Eligibility" and "bold" in title_type.lower():
-                    if comp_plan_details.check_if_title_is_empty("Metric Bucket"):
-
-                        product_eligibility = return_none_if_empty(comp_plan_details.parse_product_eligibility)
-
-                        infos.append({
-                            "product_eligibility": product_eligibility
-                        })
-                    else:
-                        product_eligibility = return_none_if_empty(comp_plan_details.parse_product_eligibility)
-
-                        merged_page_new_title = comp_plan_details.parse_details_title(merged_page=True)[0]
-                        info = parse_content_details(merged_page_new_title, comp_plan_details)
-                        
-                        infos.append({
-                            "product_eligibility": product_eligibility
-                        })
-                        infos.append(info)
-                        
-                else: ## if the page do not have any title or simply do not have anything
-                    if title_type == "None":
-                        continue
-                    num_page_to_last_table = 1
-                    while True:
-                        try:
-                            last_page = pages[index - num_page_to_last_table]
-                            last_page_tables = CompPlanDetails(last_page, last_page.height, last_page.width).parse_product_eligibility(last_page=True)
-                            break
-                        except IndexError:
-                            num_page_to_last_table += 1
-                    remaining_table = comp_plan_details.parse_next_page_product_eligibility()
-                    tables = {}
-                    for last_page_table_idx, last_page_table in enumerate(last_page_tables):
-                        table = categorize_col_infos(remaining_table, last_page_table)
-                        if sum([bool(item) for item in table]) > 0:
-                            tables[last_page_table_idx] = table
-                    pe_dfs = infos[-1]["product_eligibility"]
-                    # print(len(pe_dfs))
-                    for table_idx in tables:
-                        pe_df = pe_dfs[table_idx]
-                        df_cols = pe_df.columns.tolist()
-                        pe_df.columns = range(len(df_cols))
-                        # print(pe_df)
-                        remaining_df = pd.DataFrame(tables[table_idx], index=pe_df.columns).replace("", np.nan).T
-                        pe_df = pd.concat([pe_df, remaining_df], axis=0).reset_index(drop=True)
-                        pe_df.columns = df_cols
-                        pe_dfs[table_idx] = pe_df
-                    infos[-1]["product_eligibility"] = pe_dfs
-    return infos
+                with stage("column_anchors"):
+                    result.column_anchors = CompPlanDetails(page, page.height, page.width, anchors, tables).parse_product_eligibility(last_page=True)
+        except Exception as e:
+            result.column_anchors_error = e
+        if learn and result.content_error is None:
+            result.layout = build_layout_profile(anchors)
+    return result
+
+@timed
+def parse_degraded_page_result(page, index):
+    """PageResult of the text-only fallback, see parse_degraded_page_content"""
+    timings = current_timings()
+    with timings.page(index) if timings is not None else nullcontext():
+        result = PageResult(degraded=True)
+        try:
+            scan = scan_page(page, index)
+            result.page_class = scan.page_class
+            result.content = parse_degraded_page_content(page, index, scan)
+        except Exception as e:
+            result.content_error = e
+        if result.content is not None and result.content["type"] == "product_eligibility":
+            result.column_anchors = result.content["column_anchors"]
+        else:
+            result.column_anchors_error = IndexError("no product eligibility tables on page {}".format(index))
+    return result
+
+_worker_pdf = None
+_worker_shared_tables = False
+_worker_profiles = None
+
+def _init_page_worker(file, shared_tables=False, profiles=None):
+    global _worker_pdf, _worker_shared_tables, _worker_profiles
+    _worker_pdf = pdfplumber.open(file)
+    _worker_shared_tables = shared_tables
+    _worker_profiles = profiles
+
+def _parse_page_result(index):
+    page = _worker_pdf.pages[index]
+    timings = StageTimings()
+    with timings.activate():
+        result = parse_page_result(page, index, _worker_shared_tables, _worker_profiles)
+    result.timings = timings.pages.get(index)
+    page.close()
+    return result
+
+def _supervised_page_worker(conn, file, shared_tables=False, profiles=None):
+    _init_page_worker(file, shared_tables, profiles)
+    while (index := conn.recv()) is not None:
+        conn.send(_parse_page_result(index))
+
+class PageSupervisor:
+    """Page worker processes that are handed one page at a time, so a page running over its budget
+    can be stopped by killing just its worker, which is then replaced"""
+
+    def __init__(self, file, workers=1, shared_tables=False, profiles=None):
+        self.args = (file, shared_tables, profiles)
+        self.context = multiprocessing.get_context()
+        self.idle = [self.start_worker() for _ in range(max(1, workers))]
+        self.running = {} # conn -> (process, page index, start time)
+
+    def start_worker(self):
+        conn, child_conn = self.context.Pipe()
+        process = self.context.Process(target=_supervised_page_worker, args=(child_conn, *self.args), daemon=True)
+        process.start()
+        child_conn.close()
+        return process, conn
+
+    def stop_worker(self, process, conn, kill=False):
+        if kill:
+            process.kill()
+        else:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                process.kill()
+        process.join()
+        conn.close()
+
+    def run(self, indexes, page_budget=None, deadline=None):
+        """Yields (index, PageResult) as pages finish, or (index, None) for a page that went over
+        `page_budget` seconds, crashed its worker, or was not done by the `deadline` (time.monotonic)"""
+        pending = deque(indexes)
+        while pending or self.running:
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                # no page is handed out after the deadline, so the stopped workers are not replaced
+                for conn, (process, index, _) in list(self.running.items()):
+                    self.stop_worker(process, conn, kill=True)
+                    yield index, None
+                self.running.clear()
+                while pending:
+                    yield pending.popleft(), None
+                return
+            while self.idle and pending:
+                process, conn = self.idle.pop()
+                index = pending.popleft()
+                conn.send(index)
+                self.running[conn] = (process, index, time.monotonic())
+            limits = [start + page_budget for _, _, start in self.running.values()] if page_budget else []
+            if deadline is not None:
+                limits.append(deadline)
+            timeout = max(0, min(limits) - time.monotonic()) if limits else None
+            for conn in wait_connections(list(self.running), timeout):
+                process, index, _ = self.running.pop(conn)
+                try:
+                    result = conn.recv()
+                except (EOFError, OSError):
+                    self.stop_worker(process, conn, kill=True)
+                    self.idle.append(self.start_worker())
+                    yield index, None
+                    continue
+                self.idle.append((process, conn))
+                yield index, result
+            if page_budget:
+                now = time.monotonic()
+                for conn, (process, index, start) in list(self.running.items()):
+                    if now - start > page_budget:
+                        del self.running[conn]
+                        self.stop_worker(process, conn, kill=True)
+                        self.idle.append(self.start_worker())
+                        yield index, None
+
+    def close(self):
+        for conn, (process, _, _) in self.running.items():
+            self.stop_worker(process, conn, kill=True)
+        for process, conn in self.idle:
+            self.stop_worker(process, conn)
+        self.running, self.idle = {}, []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def collect_page_results(file, workers=None, progress=None, page_cache=None, shared_tables=False, streaming=False, monitor=None, profiles=None, page_budget=None, document_budget=None):
+    """PageResult of every page, parsed in this process or across a pool of `workers` processes.
+    Pages whose fingerprint is already in `page_cache` are not parsed again. With a `page_budget`
+    or `document_budget` (seconds) the pages run under a PageSupervisor, and a page that runs out
+    of time is parsed again by the text-only fallback"""
+    monitor = monitor or MemoryMonitor()
+    deadline = time.monotonic() + document_budget if document_budget else None
+    with pdfplumber.open(file) as pdf:
+        pages = pdf.pages
+        num_pages = len(pages)
+        results = [None] * num_pages
+        keys = [None] * num_pages
+        if page_cache is not None:
+            with stage("page_cache"):
+                for index, page in enumerate(pages):
+                    keys[index] = page_cache.key(page, index)
+                    results[index] = page_cache.get(keys[index])
+        missing = [index for index, result in enumerate(results) if result is None]
+        pages_done = num_pages - len(missing)
+        if progress and pages_done:
+            progress(pages_done, num_pages)
+
+        timings = current_timings()
+
+        def store(index, result):
+            nonlocal pages_done
+            if result.timings is not None:
+                if timings is not None:
+                    timings.add_page(index, result.timings)
+                result.timings = None
+            results[index] = result
+            if page_cache is not None and result.is_reusable():
+                # the learned layout is only needed until the document is done, it is not cached with the page
+                layout, result.layout = result.layout, None
+                page_cache.put(keys[index], result)
+                result.layout = layout
+            monitor.sample()
+            if streaming:
+                pages[index].close()
+                monitor.enforce(pdf)
+            pages_done += 1
+            if progress:
+                progress(pages_done, num_pages)
+
+        if page_budget or document_budget:
+            with PageSupervisor(file, workers or 1, shared_tables, profiles) as supervisor:
+                for index, result in supervisor.run(missing, page_budget, deadline):
+                    store(index, result if result is not None else parse_degraded_page_result(pages[index], index))
+        elif workers and workers > 1 and len(missing) > 1:
+            chunksize = max(1, len(missing) // (workers * 4))
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_page_worker, initargs=(file, shared_tables, profiles)) as executor:
+                for index, result in zip(missing, executor.map(_parse_page_result, missing, chunksize=chunksize)):
+                    store(index, result)
+        else:
+            for index in missing:
+                store(index, parse_page_result(pages[index], index, shared_tables, profiles))
+    return results
+
+class MemoryLimitExceeded(MemoryError):
+    pass
+
+def current_rss():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+@dataclass
+class MemoryMonitor:
+    """Samples the process RSS after every page, the peak is per document at page granularity.
+    `limit` caps how far RSS grows over `baseline`, its level when the document started, so a
+    long-lived process whose RSS never shrinks back after a large document keeps extracting.
+    Only this process is measured: the page workers of workers > 1 are covered by neither the
+    limit nor the peak"""
+    limit: int = None
+    peak_rss: int = None
+    baseline: int = field(default_factory=lambda: current_rss() or 0)
+
+    def sample(self):
+        if (rss := current_rss()) is not None:
+            self.peak_rss = max(self.peak_rss or 0, rss)
+        return rss
+
+    def enforce(self, pdf):
+        if not self.limit or (rss := current_rss()) is None or rss - self.baseline <= self.limit:
+            return
+        # over the ceiling, drop the document-wide object caches pdfminer keeps for the whole run
+        for cache in ("_cached_objs", "_parsed_objs"):
+            getattr(pdf.doc, cache, {}).clear()
+        gc.collect()
+        if (growth := current_rss() - self.baseline) > self.limit:
+            raise MemoryLimitExceeded(f"RSS grew {growth / 2**20:.0f} MB while extracting, over the {self.limit / 2**20:.0f} MB limit")
+
+    def write_report(self, report):
+        if report is not None:
+            report["peak_rss"] = self.peak_rss
+
+@timed
+def merge_page_results(results):
+    """Rebuilds `infos` from the PageResult of every page, in page order"""
+    def column_anchors(page_index):
+        return results[page_index].get_column_anchors()
+
+    infos = []
+    for index, result in enumerate(results):
+        merge_page_content(infos, index, result.get_content(), column_anchors)
+    return build_eligibility_tables(infos)
 
 @dataclass
 class ComplanTemplate:
@@ -381,12 +1100,21 @@ class ComplanTemplate:
         return f"## Role Title: {info['Title']}"
      
     def render_metric_bucket_weightage(self, info):
+        metrics = self.metric_bucket_rows(info)
+        render_template = f"""\
+"""
+        render_template += f"""
+{pd.DataFrame(metrics, columns=["Metric Bucket", "Weightage"]).to_markdown(index=False)}
+
+"""
+        return render_template
+
+    def metric_bucket_rows(self, info):
+        """[metric bucket, weightage] pairs split out of the metric bucket cell"""
         try:
             buckets = info["Metric Bucket Weightage"][0][0][0].split("\n")
         except IndexError:
             buckets = ["No Data"]
-        render_template = f"""\
-"""
         metrics = []
         for idx, bucket in enumerate(buckets):
             # print(bucket)
@@ -398,11 +1126,7 @@ class ComplanTemplate:
                     metric_info = re.split(match_pattern, buckets[idx - 1] + " " + bucket.replace("■", "").strip()) 
                 metrics.append(metric_info)
         # print(metrics)
-        render_template += f"""
-{pd.DataFrame(metrics, columns=["Metric Bucket", "Weightage"]).to_markdown(index=False)}
-
-"""
-        return render_template
+        return metrics
     
     def render_paycurve(self, info):
         paycurve = pd.DataFrame(info["Pay Curve"], columns=["Attainment", "Pay Out"]).to_markdown(index=False)
@@ -427,6 +1151,13 @@ the Other Information of {info['Title']} is {other_information}
 """
     
     def render_attainment_modifier(self, info):
+        attainment_modifier_df = self.attainment_modifier_rows(info)
+        return f"""\
+{list(attainment_modifier_df.values) if type(attainment_modifier_df) is not str else attainment_modifier_df }
+"""
+
+    def attainment_modifier_rows(self, info):
+        """Product and Modifier DataFrame, one row per product of each modifier"""
         modifier_df = pd.DataFrame(info["Attainment Modifiers"]).dropna(thresh=2)
         spliited_modifiers = []
         for row, value in modifier_df.iterrows():
@@ -435,40 +1166,230 @@ the Other Information of {info['Title']} is {other_information}
             for modifier in modifiers.split("\n"):
                 for product in products.split("\n"):
                     spliited_modifiers.append([product, modifier])
-        attainment_modifier_df = pd.DataFrame(spliited_modifiers, columns=["Product", "Modifier"]).drop_duplicates(["Product", "Modifier"])
-        return f"""\
-{list(attainment_modifier_df.values) if type(attainment_modifier_df) is not str else attainment_modifier_df }
-"""
+        return pd.DataFrame(spliited_modifiers, columns=["Product", "Modifier"]).drop_duplicates(["Product", "Modifier"])
     
     def render_product_eligibilities(self, role_titles: list[str]):
+        return "".join(self.iter_product_eligibilities(role_titles))
+
+    def iter_product_eligibilities(self, role_titles: list[str]):
         info = self.info["product_eligibility"]
-        render_template = f"""\n
+        yield f"""\n
 ### the Product Eligibility of {role_titles} is:
 """
         for df in info:
-            # print(df)
-            render_template += f"""
-{list(df.values)}
-"""
-        return render_template
+            yield "\n"
+            yield from iter_values_repr(df)
+            yield "\n"
 
-def render_comp_plan_template(comp_plan):
-    template = ""
+def iter_values_repr(df, chunk_rows=1000):
+    """Same text as repr(list(df.values)), produced a chunk of rows at a time"""
+    yield "["
+    for start in range(0, len(df), chunk_rows):
+        rows = df.iloc[start:start + chunk_rows].values
+        yield ("" if start == 0 else ", ") + ", ".join(repr(row) for row in rows)
+    yield "]"
+
+def iter_comp_plan_template(comp_plan):
+    """Yields the rendered template section by section, render_comp_plan_template joins it"""
+    role_titles = []
+    for info in comp_plan:
+        content = ComplanTemplate(info)
+        if info.get("Degraded"):
+            yield "### Degraded: parsed with the text-only fallback after going over the time budget, tables are missing or flattened\n"
+        if "Document Title" in info:
+            yield content.render_table_of_contents()
+        elif "Title" in info:
+            yield content.render_role_details()
+            role_titles.append(info["Title"])
+        else:
+            yield from content.iter_product_eligibilities(role_titles)
+            role_titles = []
+        yield "===" * 60 + "\n"
+
+def iter_comp_plan_sections(comp_plan):
+    """The sections of iter_comp_plan_template as plain records instead of text: the document,
+    each role with its metric buckets, pay curve and attainment modifiers, and each product
+    eligibility block with the roles it follows. Attainment modifiers and eligibility tables stay DataFrames"""
     role_titles = []
     for info in comp_plan:
         content = ComplanTemplate(info)
+        degraded = bool(info.get("Degraded"))
         if "Document Title" in info:
-            template += content.render_table_of_contents()
+            yield {
+                "section": "document",
+                "title": info["Document Title"],
+                "roles_availability": {
+                    group: [detail.strip() for detail in details if detail.strip() != ""]
+                    for group, details in info["Roles Availability"].items()
+                }
+            }
         elif "Title" in info:
-            template += content.render_role_details()
+            yield {
+                "section": "role",
+                "title": info["Title"],
+                "metric_buckets": [list(metric) for metric in content.metric_bucket_rows(info)],
+                "pay_curve": [list(row) for row in info["Pay Curve"] or []],
+                "gate_text": info.get("Gate Text"),
+                "quota_cadence": info.get("Quota Cadence"),
+                "unbalanced": info.get("Unbalanced"),
+                "other_information": info.get("Other Information"),
+                "attainment_modifiers": content.attainment_modifier_rows(info),
+                "degraded": degraded
+            }
             role_titles.append(info["Title"])
         else:
-            template += content.render_product_eligibilities(role_titles)
+            yield {"section": "product_eligibility", "roles": role_titles, "tables": info["product_eligibility"], "degraded": degraded}
             role_titles = []
-        template += "===" * 60 + "\n"
-    return template
+
+def render_comp_plan_template(comp_plan):
+    return "".join(iter_comp_plan_template(comp_plan))
 
 def output_template_to_txt(template, file_name):
+    """`template` is a rendered string or the chunks of iter_comp_plan_template, written as they come"""
     with open(file_name, "w", encoding="utf-8") as f:
-        f.write(template)
+        if isinstance(template, str):
+            f.write(template)
+        else:
+            f.writelines(template)
+
+NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+def parse_number(text, suffix):
+    """First number in `text` directly followed by `suffix` ("%" or "x"), None when there is none"""
+    match = re.search(rf"({NUMBER.pattern})\s*{re.escape(suffix)}", str(text)) if text is not None else None
+    return float(match.group(1)) if match else None
+
+def parse_attainment_range(text):
+    """(from, to) percents of a pay curve attainment such as "100%-200%" or "300%+", to is None when open ended"""
+    numbers = [float(number) for number in NUMBER.findall(str(text))] if text is not None else []
+    if not numbers:
+        return None, None
+    return numbers[0], numbers[1] if len(numbers) > 1 else None
+
+def frame_records(df):
+    """Rows of `df` as lists with the empty cells as None"""
+    return df.astype(object).where(df.notna(), None).values.tolist()
+
+def iter_comp_plan_jsonl(comp_plan):
+    """One JSON object per line for each section of iter_comp_plan_sections, with the weightages,
+    pay outs and modifiers parsed into numbers next to their text"""
+    for section in iter_comp_plan_sections(comp_plan):
+        if section["section"] == "role":
+            section = {
+                **section,
+                "metric_buckets": [
+                    {"bucket": bucket, "weightage": weightage, "weightage_percent": parse_number(weightage, "%")}
+                    for bucket, weightage in section["metric_buckets"]
+                ],
+                "pay_curve": [
+                    {"attainment": attainment, "attainment_from_percent": low, "attainment_to_percent": high,
+                     "payout": payout, "payout_multiplier": parse_number(payout, "x")}
+                    for attainment, payout in section["pay_curve"]
+                    for low, high in [parse_attainment_range(attainment)]
+                ],
+                "attainment_modifiers": [
+                    {"product": product, "modifier": modifier, "modifier_multiplier": parse_number(modifier, "x")}
+                    for product, modifier in section["attainment_modifiers"].itertuples(index=False)
+                ],
+            }
+        elif section["section"] == "product_eligibility":
+            section = {
+                **section,
+                "tables": [{"columns": [str(column) for column in df.columns], "rows": frame_records(df)} for df in section["tables"]]
+            }
+        yield json.dumps(section, ensure_ascii=False) + "\n"
+
+def output_comp_plan_jsonl(comp_plan, file_name):
+    output_template_to_txt(iter_comp_plan_jsonl(comp_plan), file_name)
+
+def column_names(columns):
+    """Eligibility headers as unique strings, Parquet needs a name for every column"""
+    names, seen = [], Counter()
+    for idx, column in enumerate(columns):
+        name = str(column).strip() if column is not None and not (isinstance(column, float) and np.isnan(column)) else ""
+        name = name or f"column_{idx}"
+        seen[name] += 1
+        names.append(name if seen[name] == 1 else f"{name}_{seen[name]}")
+    return names
+
+def comp_plan_frames(comp_plan):
+    """The product eligibility rows and the attainment modifiers of a plan as two long DataFrames.
+    Columns are gathered from the parsed DataFrames and each frame is built once, eligibility tables
+    with other headers add their own columns, empty for the rows of the other tables"""
+    document = None
+    eligibility = {"document": [], "block": [], "table": [], "row": [], "roles": [], "degraded": []}
+    cells = {}
+    modifiers = {"document": [], "role": [], "position": [], "product": [], "modifier": [], "modifier_multiplier": []}
+    block = 0
+    for section in iter_comp_plan_sections(comp_plan):
+        if section["section"] == "document":
+            document = section["title"]
+        elif section["section"] == "role":
+            modifier_df = section["attainment_modifiers"]
+            products, values = modifier_df["Product"].tolist(), modifier_df["Modifier"].tolist()
+            modifiers["document"] += [document] * len(products)
+            modifiers["role"] += [section["title"]] * len(products)
+            modifiers["position"] += range(len(products))
+            modifiers["product"] += products
+            modifiers["modifier"] += values
+            modifiers["modifier_multiplier"] += [parse_number(value, "x") for value in values]
+        else:
+            for table_idx, df in enumerate(section["tables"]):
+                num_rows, num_before = len(df), len(eligibility["row"])
+                eligibility["document"] += [document] * num_rows
+                eligibility["block"] += [block] * num_rows
+                eligibility["table"] += [table_idx] * num_rows
+                eligibility["row"] += range(num_rows)
+                eligibility["roles"] += [list(section["roles"])] * num_rows
+                eligibility["degraded"] += [section["degraded"]] * num_rows
+                names = column_names(df.columns)
+                for name, column in zip(names, zip(*frame_records(df)) if num_rows else [()] * len(names)):
+                    cells.setdefault(name, [None] * num_before).extend(None if value is None else str(value) for value in column)
+                for name in cells.keys() - set(names):
+                    cells[name] += [None] * num_rows
+            block += 1
+    eligibility_df = pd.DataFrame(eligibility).astype({"block": "int64", "table": "int64", "row": "int64", "degraded": "bool"})
+    for name, values in cells.items():
+        eligibility_df[name] = pd.array(values, dtype="string")
+    modifier_df = pd.DataFrame(modifiers).astype({"position": "int64", "modifier_multiplier": "float64"})
+    return eligibility_df, modifier_df
+
+def output_comp_plan_parquet(comp_plan, file_prefix):
+    """Writes the frames of comp_plan_frames to `file_prefix`.eligibility.parquet and
+    `file_prefix`.attainment_modifiers.parquet, returns the paths written"""
+    if pyarrow is None:
+        raise ImportError("pyarrow is required for the Parquet export, pip install pyarrow")
+    paths = []
+    for name, df in zip(("eligibility", "attainment_modifiers"), comp_plan_frames(comp_plan)):
+        path = f"{file_prefix}.{name}.parquet"
+        df.to_parquet(path, index=False)
+        paths.append(path)
+    return paths
+
+def export_comp_plan(comp_plan, file_prefix, formats):
+    """Writes the exports of `formats` (from EXPORT_FORMATS) to files starting with `file_prefix`,
+    returns the paths written"""
+    paths = []
+    for export_format in formats:
+        if export_format == "jsonl":
+            output_comp_plan_jsonl(comp_plan, f"{file_prefix}.jsonl")
+            paths.append(f"{file_prefix}.jsonl")
+        elif export_format == "parquet":
+            paths += output_comp_plan_parquet(comp_plan, file_prefix)
+        else:
+            raise ValueError(f"Unknown export format {export_format!r}, expected one of {', '.join(EXPORT_FORMATS)}")
+    return paths
+
+# small synthetic plan with most page classes, made by benchmarks/synthetic.py with
+#   generate("assets/warm_up.pdf", n_roles=2, n_details=1, n_mods=2, n_pe_rows=3, n_cont=1)
+WARM_UP_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "warm_up.pdf")
+
+def warm_up():
+    """Extracts and renders WARM_UP_PDF so the lazy initialization of pdfminer, pdfplumber's
+    table finder, rapidfuzz and tabulate happens before the first real document. Returns the
+    seconds it took"""
+    start = time.perf_counter()
+    comp_plan = extract_comp_plan_content(WARM_UP_PDF)
+    render_comp_plan_template(comp_plan)
+    return time.perf_counter() - start
 